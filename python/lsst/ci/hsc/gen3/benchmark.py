@@ -0,0 +1,285 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Compare the per-task resource usage of the ci_hsc_gen3 pipeline run with
+a stored baseline.
+
+The resource-usage phase of the pipeline gathers the peak memory and
+runtime of every quantum into one ``<label>_resource_usage`` table per task
+label.  This module summarizes those tables per task and reports the tasks
+whose peak memory or total runtime grew by more than a tolerance since the
+baseline was recorded.  It also reads the per-quantum budgets declared in
+``resource_budgets.yaml``, which the tests enforce.
+"""
+
+from __future__ import annotations
+
+__all__ = ("Budget", "Regression", "TaskUsage", "compare", "load_budgets", "main", "read_baseline",
+           "read_resource_usage", "write_baseline")
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import sys
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+
+import numpy as np
+import yaml
+
+from .dataset_index import DatasetIndex
+from .loading import DatasetLoader
+from .pipeline import RESOURCE_USAGE_COLLECTION
+
+_LOG = logging.getLogger(__name__)
+
+DATASET_TYPE_SUFFIX = "_resource_usage"
+"""Suffix of the names of the per-task resource-usage dataset types."""
+
+MEMORY_COLUMN = "memory"
+"""Column holding the peak resident set size of a quantum, in bytes."""
+
+RUN_TIME_COLUMN = "run_time"
+"""Column holding the CPU time of a quantum's ``run`` method, in seconds."""
+
+BUDGETS_FILE = os.path.join(os.path.dirname(__file__), "resource_budgets.yaml")
+"""Default file of per-task resource budgets."""
+
+
+@dataclasses.dataclass(frozen=True)
+class TaskUsage:
+    """Resource usage of all quanta of one task."""
+
+    label: str
+    quanta: int
+    peak_memory: float
+    """Largest peak resident set size of any quantum, in bytes."""
+
+    run_time: float
+    """Total runtime of all quanta, in seconds."""
+
+    max_run_time: float
+    """Longest runtime of any quantum, in seconds."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Budget:
+    """Largest resource usage allowed for any quantum of a task."""
+
+    memory: float
+    """Peak resident set size, in bytes."""
+
+    run_time: float
+    """Runtime, in seconds."""
+
+
+@dataclasses.dataclass(frozen=True)
+class Regression:
+    """A task whose resource usage exceeds its baseline."""
+
+    label: str
+    metric: str
+    """``peak_memory``, ``run_time`` or ``quanta``."""
+
+    baseline: float
+    current: float | None
+    """Current value, or `None` if the task no longer has resource usage."""
+
+    def __str__(self) -> str:
+        if self.current is None:
+            return f"{self.label}: no resource usage (baseline {self.metric}={self.baseline:g})"
+        message = f"{self.label}: {self.metric} {self.current:g} vs. baseline {self.baseline:g}"
+        if self.baseline:
+            message += f" ({self.current/self.baseline - 1:+.0%})"
+        return message
+
+
+def read_resource_usage(butler, collections: str | Iterable[str] = RESOURCE_USAGE_COLLECTION
+                        ) -> dict[str, TaskUsage]:
+    """Summarize the gathered resource-usage tables.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler for the repository.
+    collections : `str` or `~collections.abc.Iterable` [`str`], optional
+        Collections holding the resource-usage tables.
+
+    Returns
+    -------
+    usage : `dict` [`str`, `TaskUsage`]
+        Resource usage keyed by task label.
+    """
+    index = DatasetIndex(butler, collections)
+    refs = [ref for name in sorted(index.dataset_types) if name.endswith(DATASET_TYPE_SUFFIX)
+            for ref in index.refs(name)]
+    memory: dict[str, list] = {}
+    run_time: dict[str, list] = {}
+    loader = DatasetLoader(butler)
+    for ref, table in loader.iter_get(refs, columns=[MEMORY_COLUMN, RUN_TIME_COLUMN]):
+        label = ref.datasetType.name.removesuffix(DATASET_TYPE_SUFFIX)
+        memory.setdefault(label, []).append(np.asarray(table[MEMORY_COLUMN], dtype=float))
+        run_time.setdefault(label, []).append(np.asarray(table[RUN_TIME_COLUMN], dtype=float))
+    usage = {}
+    for label in memory:
+        task_memory = np.concatenate(memory[label])
+        task_run_time = np.concatenate(run_time[label])
+        usage[label] = TaskUsage(
+            label=label,
+            quanta=len(task_memory),
+            peak_memory=float(np.nanmax(task_memory)) if len(task_memory) else 0.0,
+            run_time=float(np.nansum(task_run_time)),
+            max_run_time=float(np.nanmax(task_run_time)) if len(task_run_time) else 0.0,
+        )
+    return usage
+
+
+def load_budgets(path: str = BUDGETS_FILE) -> dict[str, Budget]:
+    """Read per-task resource budgets.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        YAML file with a ``default`` budget and per-label overrides under
+        ``tasks``, each with ``memory`` (in MiB) and ``run_time`` (in
+        seconds) entries; missing entries are taken from the default.
+
+    Returns
+    -------
+    budgets : `collections.defaultdict` [`str`, `Budget`]
+        Budgets keyed by task label; labels without their own budget get
+        the default.
+    """
+    with open(path) as stream:
+        config = yaml.safe_load(stream)
+
+    def make_budget(values):
+        values = dict(config["default"], **(values or {}))
+        return Budget(memory=values["memory"]*1024**2, run_time=values["run_time"])
+
+    default = make_budget({})
+    budgets = defaultdict(lambda: default)
+    budgets.update({label: make_budget(values) for label, values in config.get("tasks", {}).items()})
+    return budgets
+
+
+def read_baseline(path: str) -> dict[str, TaskUsage]:
+    """Read a baseline written by `write_baseline`."""
+    with open(path) as stream:
+        return {label: TaskUsage(label=label, **values) for label, values in json.load(stream).items()}
+
+
+def write_baseline(usage: Mapping[str, TaskUsage], path: str):
+    """Write per-task resource usage as a baseline."""
+    baseline = {
+        label: {field: value for field, value in dataclasses.asdict(task).items() if field != "label"}
+        for label, task in sorted(usage.items())
+    }
+    with open(path, "w") as stream:
+        json.dump(baseline, stream, indent=2)
+        stream.write("\n")
+
+
+def compare(current: Mapping[str, TaskUsage], baseline: Mapping[str, TaskUsage], *,
+            memory_tolerance: float = 0.1, time_tolerance: float = 0.5,
+            min_run_time: float = 10.0) -> list[Regression]:
+    """Compare resource usage with a baseline.
+
+    Parameters
+    ----------
+    current : `~collections.abc.Mapping` [`str`, `TaskUsage`]
+        Resource usage of the current run, keyed by task label.
+    baseline : `~collections.abc.Mapping` [`str`, `TaskUsage`]
+        Baseline resource usage, keyed by task label.
+    memory_tolerance : `float`, optional
+        Largest allowed fractional increase of a task's peak memory.
+    time_tolerance : `float`, optional
+        Largest allowed fractional increase of a task's total runtime.
+    min_run_time : `float`, optional
+        Runtimes are only compared for tasks that took at least this many
+        seconds in the baseline, since shorter ones are dominated by noise.
+
+    Returns
+    -------
+    regressions : `list` [`Regression`]
+        Tasks whose resource usage exceeds the tolerances, or that have
+        fewer quanta than, or are missing from, the current run.  Tasks that
+        are not in the baseline are ignored.
+    """
+    regressions = []
+    for label, expected in sorted(baseline.items()):
+        task = current.get(label)
+        if task is None:
+            regressions.append(Regression(label, "quanta", expected.quanta, None))
+            continue
+        if task.quanta < expected.quanta:
+            regressions.append(Regression(label, "quanta", expected.quanta, task.quanta))
+        if task.peak_memory > expected.peak_memory*(1 + memory_tolerance):
+            regressions.append(Regression(label, "peak_memory", expected.peak_memory, task.peak_memory))
+        if expected.run_time >= min_run_time and task.run_time > expected.run_time*(1 + time_tolerance):
+            regressions.append(Regression(label, "run_time", expected.run_time, task.run_time))
+    return regressions
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``runBenchmark.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the data repository.")
+    parser.add_argument("--baseline", required=True, help="JSON file of baseline resource usage.")
+    parser.add_argument("--collection", default=RESOURCE_USAGE_COLLECTION,
+                        help=("Collection of the resource-usage tables; default is "
+                              f"{RESOURCE_USAGE_COLLECTION}."))
+    parser.add_argument("--memory-tolerance", type=float, default=0.1,
+                        help="Largest allowed fractional increase of peak memory; default is 0.1.")
+    parser.add_argument("--time-tolerance", type=float, default=0.5,
+                        help="Largest allowed fractional increase of total runtime; default is 0.5.")
+    parser.add_argument("--min-run-time", type=float, default=10.0,
+                        help="Only compare runtimes of tasks taking at least this many seconds.")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Write the current resource usage to the baseline file instead of comparing.")
+    parser.add_argument("--output", default=None, help="Write the current resource usage to this file.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from lsst.daf.butler import Butler
+
+    butler = Butler.from_config(args.repo, writeable=False)
+    usage = read_resource_usage(butler, args.collection)
+    if args.output:
+        write_baseline(usage, args.output)
+    if args.update_baseline:
+        write_baseline(usage, args.baseline)
+        _LOG.info("Wrote resource usage of %d tasks to %s.", len(usage), args.baseline)
+        return
+    try:
+        baseline = read_baseline(args.baseline)
+    except FileNotFoundError:
+        _LOG.error("No baseline at %s; rerun with --update-baseline to record one.", args.baseline)
+        sys.exit(1)
+    regressions = compare(usage, baseline, memory_tolerance=args.memory_tolerance,
+                          time_tolerance=args.time_tolerance, min_run_time=args.min_run_time)
+    for regression in regressions:
+        _LOG.error("Resource usage regression: %s", regression)
+    _LOG.info("Compared resource usage of %d tasks with %s: %d regressions.", len(baseline),
+              args.baseline, len(regressions))
+    if regressions:
+        sys.exit(1)
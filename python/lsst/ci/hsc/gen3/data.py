@@ -18,7 +18,240 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-DATA_IDS = [
+"""Data IDs of the raw exposures processed by ci_hsc_gen3, and of those
+expected to fail particular steps of the pipeline.
+
+The data IDs are held in immutable `DataIdTable` instances, which behave
+like sequences of ``{visit, detector, physical_filter}`` mappings and index
+their rows by visit, detector and physical filter when constructed, so
+selections and counts do not scan every row.
+"""
+
+from __future__ import annotations
+
+__all__ = (
+    "ASTROMETRY_FAILURE_DATA_IDS",
+    "DATA_IDS",
+    "DataId",
+    "DataIdTable",
+    "INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS",
+    "PSF_MODEL_ROBUSTNESS_FAILURE_DATA_IDS",
+)
+
+from collections.abc import Iterable, Iterator, Mapping, Sequence, Set
+
+
+class DataId(Mapping):
+    """An immutable ``{visit, detector, physical_filter}`` data ID.
+
+    Instances compare equal to, and can be used wherever the code expects,
+    plain `dict` data IDs with the same values.
+    """
+
+    __slots__ = ("visit", "detector", "physical_filter")
+
+    visit: int
+    detector: int
+    physical_filter: str
+
+    def __init__(self, visit: int, detector: int, physical_filter: str):
+        object.__setattr__(self, "visit", visit)
+        object.__setattr__(self, "detector", detector)
+        object.__setattr__(self, "physical_filter", physical_filter)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return (DataId, (self.visit, self.detector, self.physical_filter))
+
+    @property
+    def key(self) -> tuple[int, int]:
+        """The ``(visit, detector)`` tuple that identifies this data ID."""
+        return (self.visit, self.detector)
+
+
+class DataIdTable(Sequence[DataId]):
+    """An immutable table of `DataId` rows.
+
+    Parameters
+    ----------
+    data_ids : `~collections.abc.Iterable` [`~collections.abc.Mapping`]
+        Data IDs with ``visit``, ``detector`` and ``physical_filter`` keys.
+        Rows are kept in the order given.
+    deduplicate : `bool`, optional
+        If `True`, drop rows that repeat an earlier row.
+
+    Raises
+    ------
+    ValueError
+        Raised if a row has the same ``(visit, detector)`` as an earlier one,
+        unless ``deduplicate`` is `True` and the rows are identical.
+
+    Notes
+    -----
+    Set operations (``|``, ``&``, ``-``) compare rows by their
+    ``(visit, detector)`` key and return new tables in the order of the left
+    operand (followed, for ``|``, by the new rows of the right one); ``|``
+    raises `ValueError` if the operands disagree on the physical filter of
+    a row.
+    """
+
+    __slots__ = ("_rows", "_positions", "_by_visit", "_by_detector", "_by_physical_filter")
+
+    def __init__(self, data_ids: Iterable[Mapping] = (), *, deduplicate: bool = False):
+        rows: list[DataId] = []
+        positions: dict[tuple[int, int], int] = {}
+        by_visit: dict[int, list[int]] = {}
+        by_detector: dict[int, list[int]] = {}
+        by_physical_filter: dict[str, list[int]] = {}
+        for data_id in data_ids:
+            if not isinstance(data_id, DataId):
+                data_id = DataId(data_id["visit"], data_id["detector"], data_id["physical_filter"])
+            if data_id.key in positions:
+                if deduplicate and rows[positions[data_id.key]] == data_id:
+                    continue
+                raise ValueError(f"Duplicate data ID {data_id}; first given as "
+                                 f"{rows[positions[data_id.key]]}.")
+            position = len(rows)
+            rows.append(data_id)
+            positions[data_id.key] = position
+            by_visit.setdefault(data_id.visit, []).append(position)
+            by_detector.setdefault(data_id.detector, []).append(position)
+            by_physical_filter.setdefault(data_id.physical_filter, []).append(position)
+        self._rows = tuple(rows)
+        self._positions = positions
+        self._by_visit = {value: tuple(rows) for value, rows in by_visit.items()}
+        self._by_detector = {value: tuple(rows) for value, rows in by_detector.items()}
+        self._by_physical_filter = {value: tuple(rows) for value, rows in by_physical_filter.items()}
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return DataIdTable(self._rows[index])
+        return self._rows[index]
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __iter__(self) -> Iterator[DataId]:
+        return iter(self._rows)
+
+    def __contains__(self, data_id) -> bool:
+        try:
+            return (data_id["visit"], data_id["detector"]) in self._positions
+        except (KeyError, TypeError):
+            return False
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, DataIdTable):
+            return self._rows == other._rows
+        if isinstance(other, Sequence) and not isinstance(other, str):
+            return list(self._rows) == list(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self._rows)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({list(self._rows)!r})"
+
+    def __reduce__(self):
+        return (DataIdTable, (self._rows,))
+
+    def __or__(self, other: Iterable[Mapping]) -> DataIdTable:
+        return DataIdTable((*self._rows, *other), deduplicate=True)
+
+    def __and__(self, other: Iterable[Mapping]) -> DataIdTable:
+        keys = DataIdTable._keys_of(other)
+        return DataIdTable(row for row in self._rows if row.key in keys)
+
+    def __sub__(self, other: Iterable[Mapping]) -> DataIdTable:
+        keys = DataIdTable._keys_of(other)
+        return DataIdTable(row for row in self._rows if row.key not in keys)
+
+    @staticmethod
+    def _keys_of(data_ids: Iterable[Mapping]) -> Set[tuple[int, int]]:
+        if isinstance(data_ids, DataIdTable):
+            return data_ids._positions.keys()
+        return {(data_id["visit"], data_id["detector"]) for data_id in data_ids}
+
+    def _select(self, positions: Iterable[int]) -> DataIdTable:
+        return DataIdTable(self._rows[position] for position in positions)
+
+    @property
+    def keys(self) -> Set[tuple[int, int]]:
+        """The ``(visit, detector)`` keys of all rows."""
+        return self._positions.keys()
+
+    @property
+    def visits(self) -> tuple[int, ...]:
+        """The distinct visits, in order of first appearance."""
+        return tuple(self._by_visit)
+
+    @property
+    def detectors(self) -> tuple[int, ...]:
+        """The distinct detectors, in order of first appearance."""
+        return tuple(self._by_detector)
+
+    @property
+    def physical_filters(self) -> tuple[str, ...]:
+        """The distinct physical filters, in order of first appearance."""
+        return tuple(self._by_physical_filter)
+
+    def for_visit(self, visit: int) -> DataIdTable:
+        """Return the rows of one visit."""
+        return self._select(self._by_visit.get(visit, ()))
+
+    def for_detector(self, detector: int) -> DataIdTable:
+        """Return the rows of one detector."""
+        return self._select(self._by_detector.get(detector, ()))
+
+    def for_physical_filter(self, physical_filter: str) -> DataIdTable:
+        """Return the rows of one physical filter."""
+        return self._select(self._by_physical_filter.get(physical_filter, ()))
+
+    def to_data_coordinates(self, universe, instrument: str = "HSC") -> list:
+        """Convert the rows to butler data IDs.
+
+        Parameters
+        ----------
+        universe : `lsst.daf.butler.DimensionUniverse`
+            Dimensions of the repository.
+        instrument : `str`, optional
+            Name of the instrument.
+
+        Returns
+        -------
+        data_ids : `list` [`lsst.daf.butler.DataCoordinate`]
+            Data IDs with the ``visit``, ``detector`` and ``physical_filter``
+            dimensions, in the order of the rows.
+        """
+        from lsst.daf.butler import DataCoordinate
+
+        return [
+            DataCoordinate.standardize(dict(row), universe=universe, instrument=instrument)
+            for row in self._rows
+        ]
+
+
+DATA_IDS = DataIdTable([
     {'visit': 903334, 'detector': 16, 'physical_filter': 'HSC-R'},
     {'visit': 903334, 'detector': 22, 'physical_filter': 'HSC-R'},
     {'visit': 903334, 'detector': 23, 'physical_filter': 'HSC-R'},
@@ -52,27 +285,27 @@ DATA_IDS = [
     {'visit': 903988, 'detector': 17, 'physical_filter': 'HSC-I'},
     {'visit': 903988, 'detector': 23, 'physical_filter': 'HSC-I'},
     {'visit': 903988, 'detector': 24, 'physical_filter': 'HSC-I'},
-]
+])
 # The following lists the dataIds that fail the astrometry check with
 # the config override calibrateImage.astrometry.maxMeanDistanceArcsec=0.02
 # set.  This list is sensitive to the astrometry algorithms and dataset
 # under consideration, so may require updating if either of those change
 # in the context of this repository.
-ASTROMETRY_FAILURE_DATA_IDS = [
+ASTROMETRY_FAILURE_DATA_IDS = DataIdTable([
     {'visit': 903344, 'detector': 0, 'physical_filter': 'HSC-R'},
-]
+])
 # The following lists the dataIds that fail the PSF Model robustness check
 # with the config override makeWarp.select.maxPsfTraceRadiusDelta=0.2 set.
 # This list is sensitive to (at least) the PSF algorithms and dataset under
 # consideration, so may require updating if either of those change in the
 # context of this repository.
-PSF_MODEL_ROBUSTNESS_FAILURE_DATA_IDS = [
+PSF_MODEL_ROBUSTNESS_FAILURE_DATA_IDS = DataIdTable([
     {'visit': 903334, 'detector': 22, 'physical_filter': 'HSC-R'},
-]
+])
 # The following data IDs fail (with NoWorkFound) in subtractImages with
 # insufficient template coverage.  There are two other data IDs that succeed
 # despite also having less coverage than the threshold.
-INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS = [
+INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS = DataIdTable([
     {'visit': 903342, 'detector': 100, 'physical_filter': 'HSC-R'},
     {'visit': 904010, 'detector': 100, 'physical_filter': 'HSC-I'},
-]
+])
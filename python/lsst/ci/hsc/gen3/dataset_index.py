@@ -0,0 +1,110 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""In-memory index of the datasets in the ci_hsc_gen3 output collections."""
+
+from __future__ import annotations
+
+__all__ = ("DatasetIndex",)
+
+from collections import defaultdict
+from collections.abc import Iterable, Mapping
+
+
+class DatasetIndex:
+    """Index of all datasets in a set of collections, built with a single
+    registry query the first time it is used.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to query.
+    collections : `str` or `~collections.abc.Iterable` [`str`], optional
+        Collections to index; defaults to the butler's default collections.
+        As with ``Registry.queryDatasets``, chains are searched but not in
+        find-first order, so datasets in any child collection are included.
+    """
+
+    def __init__(self, butler, collections: str | Iterable[str] | None = None):
+        self.butler = butler
+        self.collections = collections
+        self._by_type: dict[str, dict] | None = None
+        self._stored: Mapping | None = None
+
+    def _build(self) -> dict[str, dict]:
+        if self._by_type is None:
+            by_type = defaultdict(lambda: defaultdict(list))
+            for ref in self.butler.registry.queryDatasets(..., collections=self.collections):
+                by_type[ref.datasetType.name][ref.dataId].append(ref)
+            self._by_type = {name: dict(by_data_id) for name, by_data_id in by_type.items()}
+        return self._by_type
+
+    @property
+    def dataset_types(self) -> frozenset[str]:
+        """Names of the dataset types with at least one dataset."""
+        return frozenset(self._build())
+
+    def refs(self, dataset_type: str) -> set:
+        """Return all datasets of a dataset type.
+
+        Parameters
+        ----------
+        dataset_type : `str`
+            Name of the dataset type.
+
+        Returns
+        -------
+        refs : `set` [`lsst.daf.butler.DatasetRef`]
+            Matching datasets; empty if there are none.
+        """
+        return {ref for refs in self._build().get(dataset_type, {}).values() for ref in refs}
+
+    def count(self, dataset_type: str) -> int:
+        """Return the number of datasets of a dataset type."""
+        return sum(len(refs) for refs in self._build().get(dataset_type, {}).values())
+
+    def find(self, dataset_type: str, data_id) -> list:
+        """Return the datasets of a dataset type with the given data ID.
+
+        Parameters
+        ----------
+        dataset_type : `str`
+            Name of the dataset type.
+        data_id : `lsst.daf.butler.DataCoordinate`
+            Data ID, with the dataset type's dimensions.
+
+        Returns
+        -------
+        refs : `list` [`lsst.daf.butler.DatasetRef`]
+            Matching datasets; empty if there are none.
+        """
+        return list(self._build().get(dataset_type, {}).get(data_id, ()))
+
+    def stored(self, ref) -> bool:
+        """Return whether the datastore has the artifacts of a dataset.
+
+        Existence of all indexed datasets is checked with a single
+        datastore query the first time this is called.
+        """
+        if self._stored is None:
+            self._stored = self.butler.stored_many(
+                [ref for by_data_id in self._build().values() for refs in by_data_id.values() for ref in refs]
+            )
+        return self._stored[ref]
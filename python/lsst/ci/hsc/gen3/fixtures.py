@@ -0,0 +1,225 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Shared, read-only access to the ci_hsc_gen3 data repository for the
+tests.
+
+Every test module gets its butlers from `get_butler`, which clones a single
+read-only butler per process, so the registry connection is opened and the
+dimension records are loaded once per process rather than once per test.
+Caches are keyed by process ID, so a process forked after they were
+populated (as pytest-xdist workers may be) opens its own connection.
+
+If the ``CI_HSC_GEN3_MEMORY_LIMIT`` environment variable is set (to a size
+in MiB), the tests run in memory-budget mode: `make_loader` returns loaders
+that hold at most one dataset in memory at a time, and test cases using
+`MemoryLimitMixin` fail if their peak resident set size exceeds the limit.
+
+If ``CI_HSC_GEN3_VALIDATION_MANIFEST`` names a file, the output checks only
+check datasets that are new or have changed since they last passed (see
+`get_validation_manifest`).
+"""
+
+from __future__ import annotations
+
+__all__ = ("MEMORY_LIMIT_ENV", "MemoryLimitMixin", "VALIDATION_MANIFEST_ENV", "get_butler",
+           "get_dataset_index", "get_memory_limit", "get_repo_root", "get_validation_manifest",
+           "get_visit_catalog_cache", "make_loader")
+
+import atexit
+import gc
+import os
+import resource
+import sys
+from collections.abc import Iterable
+
+from .dataset_index import DatasetIndex
+from .loading import DatasetLoader
+from .validation_manifest import SESSION_ENV, ValidationManifest
+from .visit_catalogs import VisitCatalogCache
+
+MEMORY_LIMIT_ENV = "CI_HSC_GEN3_MEMORY_LIMIT"
+"""Environment variable holding the peak memory limit of a test, in MiB."""
+
+VALIDATION_MANIFEST_ENV = "CI_HSC_GEN3_VALIDATION_MANIFEST"
+"""Environment variable naming the file that records the datasets that
+passed the output checks.
+"""
+
+_BUTLERS: dict[tuple, object] = {}
+_INDEXES: dict[tuple, DatasetIndex] = {}
+_VISIT_CATALOGS: dict[tuple, VisitCatalogCache] = {}
+_MANIFESTS: dict[int, ValidationManifest] = {}
+
+
+def get_repo_root() -> str:
+    """Return the root of the ci_hsc_gen3 data repository."""
+    from lsst.utils import getPackageDir
+
+    return os.path.join(getPackageDir("ci_hsc_gen3"), "DATA")
+
+
+def _make_key(collections: Iterable[str] | None, data_id: dict) -> tuple:
+    return (
+        os.getpid(),
+        tuple(collections) if collections is not None else None,
+        tuple(sorted(data_id.items())),
+    )
+
+
+def get_butler(collections: Iterable[str] | None = None, **data_id):
+    """Return a shared read-only butler.
+
+    Parameters
+    ----------
+    collections : `~collections.abc.Iterable` [`str`], optional
+        Default collections.
+    **data_id
+        Default data ID values, e.g. ``instrument="HSC"``.
+
+    Returns
+    -------
+    butler : `lsst.daf.butler.Butler`
+        Butler sharing its registry and datastore with all other butlers
+        returned by this function in the same process.  Callers must not
+        modify it.
+    """
+    from lsst.daf.butler import Butler
+
+    base_key = _make_key(None, {})
+    if base_key not in _BUTLERS:
+        _BUTLERS[base_key] = Butler.from_config(get_repo_root(), writeable=False)
+    key = _make_key(collections, data_id)
+    if key not in _BUTLERS:
+        _BUTLERS[key] = _BUTLERS[base_key].clone(
+            collections=list(collections) if collections is not None else None,
+            dataId=data_id,
+        )
+    return _BUTLERS[key]
+
+
+def get_dataset_index(collections: Iterable[str]) -> DatasetIndex:
+    """Return a shared `DatasetIndex` of a set of collections.
+
+    The index is built on first use and then reused by every test in the
+    process.
+    """
+    key = _make_key(collections, {})
+    if key not in _INDEXES:
+        _INDEXES[key] = DatasetIndex(get_butler(collections))
+    return _INDEXES[key]
+
+
+def get_visit_catalog_cache(collections: Iterable[str], **data_id) -> VisitCatalogCache:
+    """Return a shared `VisitCatalogCache` reading from a set of
+    collections.
+
+    Parameters are as for `get_butler`.
+    """
+    key = _make_key(collections, data_id)
+    if key not in _VISIT_CATALOGS:
+        _VISIT_CATALOGS[key] = VisitCatalogCache(get_butler(collections, **data_id))
+    return _VISIT_CATALOGS[key]
+
+
+def get_validation_manifest() -> ValidationManifest:
+    """Return the shared `ValidationManifest`.
+
+    The manifest is read from the file named by
+    ``CI_HSC_GEN3_VALIDATION_MANIFEST`` and the results recorded by the
+    process are merged back into it when the process exits.  If the
+    variable is not set, every dataset is checked and nothing is recorded.
+    """
+    pid = os.getpid()
+    if pid not in _MANIFESTS:
+        _MANIFESTS[pid] = ValidationManifest(os.environ.get(VALIDATION_MANIFEST_ENV) or None,
+                                             session=os.environ.get(SESSION_ENV))
+        atexit.register(_MANIFESTS[pid].save)
+    return _MANIFESTS[pid]
+
+
+def get_memory_limit() -> int | None:
+    """Return the peak memory limit of a test in bytes, or `None` if the
+    tests are not running in memory-budget mode.
+    """
+    value = os.environ.get(MEMORY_LIMIT_ENV)
+    return int(float(value)*1024**2) if value else None
+
+
+def make_loader(butler) -> DatasetLoader:
+    """Return a loader for the datasets checked by a test.
+
+    In memory-budget mode the loader reads one dataset at a time, in the
+    calling thread, and does not read the next one until the previous one
+    has been released.
+    """
+    if get_memory_limit() is not None:
+        return DatasetLoader(butler, max_workers=1, memory_budget=0)
+    return DatasetLoader(butler)
+
+
+def _reset_peak_rss() -> bool:
+    """Reset the peak resident set size of this process to its current
+    resident set size, if the platform allows it.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as stream:
+            stream.write("5")
+    except OSError:
+        return False
+    return True
+
+
+def _get_peak_rss() -> int:
+    """Return the peak resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/status") as stream:
+            for line in stream:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage*1024
+
+
+class MemoryLimitMixin:
+    """Mixin for test cases that fails tests whose peak resident set size
+    exceeds the limit set by ``CI_HSC_GEN3_MEMORY_LIMIT``.
+
+    The peak is reset before each test on Linux; elsewhere it is the peak of
+    the whole process so far.  Subclasses that override ``setUp`` or
+    ``tearDown`` must call the base class implementation.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._memory_limit = get_memory_limit()
+        if self._memory_limit is not None:
+            gc.collect()
+            _reset_peak_rss()
+
+    def tearDown(self):
+        if self._memory_limit is not None:
+            peak_rss = _get_peak_rss()
+            if peak_rss > self._memory_limit:
+                self.fail(f"Peak resident set size {peak_rss/1024**2:.0f} MiB exceeds the limit of "
+                          f"{self._memory_limit/1024**2:.0f} MiB.")
+        super().tearDown()
@@ -0,0 +1,299 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Ingest of the external (non-raw) inputs of the ci_hsc_gen3 repository.
+
+The reference catalogs, the exported calibrations and external products and
+the source-injection catalog are described by a single manifest file
+(``resources/external_manifest.yaml``) and ingested by one process with one
+`~lsst.daf.butler.Butler`, instead of one ``butler`` command per input.
+The files are linked or copied into the repository according to one of the
+`~lsst.ci.hsc.gen3.transfer.TRANSFER_MODES`.
+"""
+
+from __future__ import annotations
+
+__all__ = ("DatasetTypeSpec", "FileTableSpec", "IngestManifest", "ingest_external", "main")
+
+import argparse
+import logging
+import os
+import threading
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import yaml
+
+from .jsonl_export import import_jsonl_export, read_jsonl_export_paths
+from .transfer import TRANSFER_MODES, FileTransfer
+
+_LOG = logging.getLogger(__name__)
+
+STAGING_DIRECTORY = "ingested"
+"""Directory (relative to the repository root) that external files are
+transferred into before being ingested in place.
+"""
+
+
+@dataclass(frozen=True)
+class DatasetTypeSpec:
+    """Definition of a dataset type that must be registered before ingest."""
+
+    name: str
+    storage_class: str
+    dimensions: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class FileTableSpec:
+    """An ECSV table of files to ingest, in the format used by
+    ``butler ingest-files``: the first column holds the path of each file
+    (relative to the test data root) and the remaining columns hold the
+    data ID values.
+    """
+
+    dataset_type: str
+    run: str
+    table: str
+
+
+@dataclass(frozen=True)
+class IngestManifest:
+    """Declarative description of the external inputs to ingest.
+
+    Parameters
+    ----------
+    dataset_types : `tuple` [`DatasetTypeSpec`]
+        Dataset types to register.
+    file_tables : `tuple` [`FileTableSpec`]
+        ECSV tables of files to ingest.
+    exports : `tuple` [`str`]
+        Butler export files to import, in YAML or (with a ``.jsonl``
+        extension) the JSONL format of `~lsst.ci.hsc.gen3.jsonl_export`;
+        the file paths inside them are relative to the test data root.
+    """
+
+    dataset_types: tuple[DatasetTypeSpec, ...]
+    file_tables: tuple[FileTableSpec, ...]
+    exports: tuple[str, ...]
+
+    @classmethod
+    def from_file(cls, path: str) -> IngestManifest:
+        """Read a manifest from a YAML file.
+
+        Relative export paths are interpreted relative to the directory
+        containing the manifest.
+        """
+        with open(path) as stream:
+            content = yaml.safe_load(stream)
+        base = os.path.dirname(os.path.abspath(path))
+        return cls(
+            dataset_types=tuple(
+                DatasetTypeSpec(d["name"], d["storage_class"], tuple(d["dimensions"]))
+                for d in content.get("dataset_types", ())
+            ),
+            file_tables=tuple(
+                FileTableSpec(f["dataset_type"], f["run"], f["table"])
+                for f in content.get("file_tables", ())
+            ),
+            exports=tuple(os.path.join(base, e) for e in content.get("exports", ())),
+        )
+
+
+class _ExportLoader(yaml.SafeLoader):
+    """YAML loader for butler export files that only needs the file paths,
+    and so ignores the butler-specific tags.
+    """
+
+
+_ExportLoader.add_multi_constructor("!", lambda loader, suffix, node: None)
+
+
+def _read_export_paths(export_file: str) -> list[str]:
+    """Return the (relative) paths of all files referenced by an export
+    file.
+    """
+    if export_file.endswith(".jsonl"):
+        return read_jsonl_export_paths(export_file)
+    with open(export_file) as stream:
+        content = yaml.load(stream, Loader=_ExportLoader)
+    return [
+        record["path"]
+        for item in content["data"] if item["type"] == "dataset"
+        for record in item["records"]
+    ]
+
+
+def _read_file_table(spec: FileTableSpec, testdata_root: str) -> list[tuple[str, dict]]:
+    """Read an ECSV file table, returning (relative path, data ID) pairs."""
+    from astropy.table import Table
+
+    table = Table.read(os.path.join(testdata_root, spec.table), format="ascii.ecsv")
+    path_column, *data_id_columns = table.colnames
+    return [
+        (str(row[path_column]), {name: row[name].item() for name in data_id_columns})
+        for row in table
+    ]
+
+
+def _transfer(source: str, destination: str, transfer: FileTransfer) -> None:
+    """Transfer a single file into the repository, if not already present.
+
+    The file is transferred to a temporary name and renamed into place, so
+    a file left by an interrupted transfer is never taken for a complete
+    one.
+    """
+    if os.path.lexists(destination):
+        return
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temporary = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        transfer.transfer(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def _stage_files(paths: Iterable[str], testdata_root: str, staging_root: str, pool: ThreadPoolExecutor,
+                 transfer: FileTransfer):
+    """Transfer files from the test data root to the staging directory
+    concurrently.
+    """
+    futures = [
+        pool.submit(_transfer, os.path.join(testdata_root, path), os.path.join(staging_root, path), transfer)
+        for path in set(paths)
+    ]
+    for future in futures:
+        future.result()
+
+
+def ingest_external(butler, manifest: IngestManifest, repo_root: str, testdata_root: str,
+                    num_workers: int = 1, transfer: str = "hardlink"):
+    """Ingest all of the inputs described by a manifest.
+
+    Files are transferred into the repository's datastore root concurrently
+    and then ingested in place, so the registry inserts do not interleave
+    with file I/O; the file tables are ingested in a single transaction.
+    With the ``direct`` transfer mode, the files are ingested where they are
+    instead.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler for the repository.
+    manifest : `IngestManifest`
+        Description of the inputs to ingest.
+    repo_root : `str`
+        Root of the data repository, which must also be the root of its
+        file datastore (as it is for the default configuration).
+    testdata_root : `str`
+        Root of the ``testdata_ci_hsc`` package.
+    num_workers : `int`, optional
+        Number of threads used to read input tables and transfer files.
+    transfer : `str`, optional
+        One of `~lsst.ci.hsc.gen3.transfer.TRANSFER_MODES`.
+    """
+    from lsst.daf.butler import DataCoordinate, DatasetRef, DatasetType, FileDataset
+
+    if transfer == "direct":
+        staging_root = os.path.abspath(testdata_root)
+        butler_transfer = "direct"
+    else:
+        staging_root = os.path.join(repo_root, STAGING_DIRECTORY)
+        butler_transfer = None
+        file_transfer = FileTransfer(transfer)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        file_tables = dict(zip(
+            manifest.file_tables,
+            pool.map(lambda spec: _read_file_table(spec, testdata_root), manifest.file_tables),
+        ))
+        export_paths = dict(zip(manifest.exports, pool.map(_read_export_paths, manifest.exports)))
+        if butler_transfer is None:
+            _stage_files(
+                [path for rows in file_tables.values() for path, _ in rows]
+                + [path for paths in export_paths.values() for path in paths],
+                testdata_root,
+                staging_root,
+                pool,
+                file_transfer,
+            )
+            _LOG.info("Transferred external inputs (%s): %s.", transfer, file_transfer.stats)
+
+    # Registering dataset types and runs may create tables, which cannot be
+    # done inside a transaction, so they are registered before any is opened.
+    for spec in manifest.dataset_types:
+        _LOG.info("Registering dataset type %s.", spec.name)
+        butler.registry.registerDatasetType(
+            DatasetType(spec.name, spec.dimensions, spec.storage_class, universe=butler.dimensions)
+        )
+    for spec in file_tables:
+        butler.registry.registerRun(spec.run)
+
+    with butler.transaction():
+        for spec, rows in file_tables.items():
+            _LOG.info("Ingesting %d %s datasets into %s.", len(rows), spec.dataset_type, spec.run)
+            dataset_type = butler.registry.getDatasetType(spec.dataset_type)
+            butler.ingest(
+                *[
+                    FileDataset(
+                        path=os.path.join(staging_root, path),
+                        refs=[DatasetRef(
+                            dataset_type,
+                            DataCoordinate.standardize(data_id, dimensions=dataset_type.dimensions),
+                            run=spec.run,
+                        )],
+                    )
+                    for path, data_id in rows
+                ],
+                transfer=butler_transfer,
+            )
+
+    # Imports register the dataset types and collections they need, so they
+    # manage their own transactions.
+    for export_file in manifest.exports:
+        _LOG.info("Importing %s.", export_file)
+        if export_file.endswith(".jsonl"):
+            import_jsonl_export(butler, export_file, staging_root, transfer=butler_transfer)
+        else:
+            butler.import_(directory=staging_root, filename=export_file, transfer=butler_transfer)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``ingestExternalData.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the data repository.")
+    parser.add_argument("testdata_root", help="Root of the testdata_ci_hsc package.")
+    parser.add_argument("--manifest", required=True, help="Path to the ingest manifest.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of threads used to read inputs and transfer files.")
+    parser.add_argument("--transfer", choices=TRANSFER_MODES, default="hardlink",
+                        help="How files are transferred into the repository; default is hardlink.")
+    args = parser.parse_args(argv)
+
+    from lsst.daf.butler import Butler
+
+    logging.basicConfig(level=logging.INFO)
+    butler = Butler.from_config(args.repo, writeable=True)
+    ingest_external(butler, IngestManifest.from_file(args.manifest), args.repo, args.testdata_root,
+                    num_workers=args.jobs, transfer=args.transfer)
@@ -0,0 +1,264 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Convert butler YAML export files to line-delimited JSON, and import
+them.
+
+A JSONL export holds one JSON object per line: a header, then one line per
+collection, dataset type, file (with the IDs and data IDs of its datasets)
+and validity range of calibration associations, in the order of the YAML
+export.  Unlike ``butler import``, which parses the whole YAML document
+before inserting anything, `import_jsonl_export` reads it one line at a
+time and ingests the files in batches per dataset type and run.
+
+Only the entries found in the exports of ``resources/`` (collections,
+dataset types, datasets and associations) are supported; dimension records
+are not.
+"""
+
+from __future__ import annotations
+
+__all__ = ("JSONL_EXPORT_VERSION", "convert_yaml_export", "import_jsonl_export", "main",
+           "read_jsonl_export_paths")
+
+import argparse
+import json
+import logging
+import os
+import uuid
+from collections.abc import Iterable, Iterator
+
+import yaml
+
+_LOG = logging.getLogger(__name__)
+
+JSONL_EXPORT_VERSION = 1
+"""Version of the JSONL export format."""
+
+_SUPPORTED_TYPES = ("collection", "dataset_type", "dataset", "associations")
+
+
+class _YamlExportLoader(yaml.SafeLoader):
+    """YAML loader for butler export files that keeps the butler-specific
+    tagged values as JSON-compatible values.
+    """
+
+
+# Dataset IDs: !uuid 'xxx' becomes the UUID string, while integer IDs are
+# kept as integers.
+_YamlExportLoader.add_constructor("!uuid", lambda loader, node: loader.construct_scalar(node))
+# Times: !butler_time/<scale>/<format> 'value'.
+_YamlExportLoader.add_multi_constructor(
+    "!butler_time/",
+    lambda loader, suffix, node: dict(zip(("scale", "format"), suffix.split("/")),
+                                      value=loader.construct_scalar(node)),
+)
+
+
+def _iter_yaml_export(path: str) -> Iterator[dict]:
+    """Yield the lines of the JSONL export equivalent to a YAML export."""
+    with open(path) as stream:
+        content = yaml.load(stream, Loader=_YamlExportLoader)
+    yield {
+        "type": "header",
+        "version": JSONL_EXPORT_VERSION,
+        "source_version": content.get("version"),
+        "universe_version": content.get("universe_version"),
+        "universe_namespace": content.get("universe_namespace"),
+    }
+    for item in content["data"]:
+        if item["type"] not in _SUPPORTED_TYPES:
+            raise ValueError(f"Unsupported export entry of type {item['type']!r} in {path}.")
+        if item["type"] == "dataset":
+            for record in item["records"]:
+                yield dict(type="dataset", dataset_type=item["dataset_type"], run=item["run"], **record)
+        elif item["type"] == "associations":
+            for validity_range in item.get("validity_ranges", ()):
+                yield dict(type="associations", collection=item["collection"],
+                           collection_type=item["collection_type"], **validity_range)
+            if item.get("dataset_ids"):
+                yield dict(type="associations", collection=item["collection"],
+                           collection_type=item["collection_type"], dataset_ids=item["dataset_ids"])
+        else:
+            yield item
+
+
+def convert_yaml_export(yaml_path: str, jsonl_path: str):
+    """Convert a butler YAML export to a JSONL export.
+
+    Parameters
+    ----------
+    yaml_path : `str`
+        YAML export file, as written by ``butler export``.
+    jsonl_path : `str`
+        JSONL file to write.
+    """
+    with open(jsonl_path, "w") as stream:
+        for line in _iter_yaml_export(yaml_path):
+            stream.write(json.dumps(line, separators=(",", ":")))
+            stream.write("\n")
+
+
+def _iter_jsonl_export(path: str) -> Iterator[dict]:
+    with open(path) as stream:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+def read_jsonl_export_paths(path: str) -> list[str]:
+    """Return the (relative) paths of all files referenced by a JSONL
+    export.
+    """
+    return [entry["path"] for entry in _iter_jsonl_export(path) if entry["type"] == "dataset"]
+
+
+def _make_time(value: dict):
+    from astropy.time import Time
+
+    return Time(value["value"], format=value["format"], scale=value["scale"])
+
+
+def import_jsonl_export(butler, path: str, directory: str, *, transfer: str | None = None,
+                        batch_size: int = 1000):
+    """Import a JSONL export into a repository.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler for the repository.
+    path : `str`
+        JSONL export file.
+    directory : `str`
+        Directory the file paths in the export are relative to.
+    transfer : `str`, optional
+        Butler transfer mode of the files; `None` ingests them in place.
+    batch_size : `int`, optional
+        Largest number of files ingested by one call to
+        `~lsst.daf.butler.Butler.ingest`.
+
+    Notes
+    -----
+    As for ``butler import`` of old exports, datasets with integer IDs are
+    given new UUIDs, while UUIDs are kept.
+
+    Collections, dataset types and the runs of datasets are registered as
+    they are encountered, which may create tables; this function must
+    therefore not be called inside a transaction.  Each batch of files is
+    ingested in its own transaction.
+    """
+    from lsst.daf.butler import (
+        CollectionType,
+        DataCoordinate,
+        DatasetRef,
+        DatasetType,
+        FileDataset,
+        Timespan,
+    )
+
+    entries = _iter_jsonl_export(path)
+    header = next(entries, None)
+    if header is None or header.get("type") != "header" or header.get("version") != JSONL_EXPORT_VERSION:
+        raise ValueError(f"{path} is not a version {JSONL_EXPORT_VERSION} JSONL export.")
+
+    dataset_types: dict[str, DatasetType] = {}
+    runs: set[str] = set()
+    refs: dict[int | str, DatasetRef] = {}
+    batch: list[FileDataset] = []
+    batch_key: tuple[str, str] | None = None
+    n_files = 0
+
+    def flush():
+        nonlocal n_files
+        if batch:
+            butler.ingest(*batch, transfer=transfer)
+            n_files += len(batch)
+            batch.clear()
+
+    for entry in entries:
+        if entry["type"] == "collection":
+            collection_type = CollectionType[entry["collection_type"]]
+            if collection_type is CollectionType.RUN:
+                butler.registry.registerRun(entry["name"])
+            else:
+                butler.registry.registerCollection(entry["name"], collection_type)
+            if collection_type is CollectionType.CHAINED:
+                butler.registry.setCollectionChain(entry["name"], entry["children"])
+        elif entry["type"] == "dataset_type":
+            dataset_type = DatasetType(entry["name"], entry["dimensions"], entry["storage_class"],
+                                       universe=butler.dimensions,
+                                       isCalibration=entry.get("is_calibration", False))
+            butler.registry.registerDatasetType(dataset_type)
+            dataset_types[dataset_type.name] = dataset_type
+        elif entry["type"] == "dataset":
+            key = (entry["dataset_type"], entry["run"])
+            if key != batch_key or len(batch) >= batch_size:
+                flush()
+                batch_key = key
+            if entry["run"] not in runs:
+                # As butler import does; the run need not be listed as a
+                # collection in the export.
+                butler.registry.registerRun(entry["run"])
+                runs.add(entry["run"])
+            if entry["dataset_type"] not in dataset_types:
+                dataset_types[entry["dataset_type"]] = butler.registry.getDatasetType(entry["dataset_type"])
+            dataset_type = dataset_types[entry["dataset_type"]]
+            file_refs = []
+            for dataset_id, data_id in zip(entry["dataset_id"], entry["data_id"], strict=True):
+                ref = DatasetRef(
+                    dataset_type,
+                    DataCoordinate.standardize(data_id, dimensions=dataset_type.dimensions),
+                    run=entry["run"],
+                    id=uuid.UUID(dataset_id) if isinstance(dataset_id, str) else None,
+                )
+                refs[dataset_id] = ref
+                file_refs.append(ref)
+            batch.append(FileDataset(path=os.path.join(directory, entry["path"]), refs=file_refs,
+                                     formatter=entry.get("formatter")))
+        elif entry["type"] == "associations":
+            # Associations refer to datasets earlier in the export.
+            flush()
+            associated = [refs[dataset_id] for dataset_id in entry["dataset_ids"]]
+            if entry["collection_type"] == "CALIBRATION":
+                timespan = Timespan(
+                    _make_time(entry["begin"]) if entry.get("begin") else None,
+                    _make_time(entry["end"]) if entry.get("end") else None,
+                )
+                butler.registry.certify(entry["collection"], associated, timespan)
+            else:
+                butler.registry.associate(entry["collection"], associated)
+        else:
+            raise ValueError(f"Unsupported entry of type {entry['type']!r} in {path}.")
+    flush()
+    _LOG.info("Imported %d files with %d datasets from %s.", n_files, len(refs), path)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``convertExport.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("yaml", help="Butler YAML export file.")
+    parser.add_argument("jsonl", nargs="?", default=None,
+                        help="JSONL file to write; default is the YAML path with a .jsonl extension.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    jsonl = args.jsonl or os.path.splitext(args.yaml)[0] + ".jsonl"
+    convert_yaml_export(args.yaml, jsonl)
+    _LOG.info("Converted %s to %s.", args.yaml, jsonl)
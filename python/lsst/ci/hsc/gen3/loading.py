@@ -0,0 +1,239 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Concurrent loading of the datasets checked by the output validation
+tests.
+"""
+
+from __future__ import annotations
+
+__all__ = ("DatasetLoader", "read_row_count")
+
+import threading
+from collections.abc import Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+
+def _is_afw_catalog(ref) -> bool:
+    from lsst.afw.table import BaseCatalog
+
+    pytype = ref.datasetType.storageClass.pytype
+    return isinstance(pytype, type) and issubclass(pytype, BaseCatalog)
+
+
+def read_row_count(butler, ref) -> int:
+    """Return the number of rows in a tabular dataset without reading the
+    table itself where possible.
+
+    Parquet files are counted from their footer and afw table FITS files
+    from the ``NAXIS2`` keyword of the catalog HDU.  Other datasets use the
+    ``rowcount`` component if their storage class has one, and are read in
+    full otherwise.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to read from.
+    ref : `lsst.daf.butler.DatasetRef`
+        Dataset to count.
+
+    Returns
+    -------
+    count : `int`
+        Number of rows.
+    """
+    try:
+        uri = butler.getURI(ref)
+    except RuntimeError:
+        # Disassembled composites have no single URI.
+        uri = None
+    if uri is not None:
+        extension = uri.getExtension()
+        if extension in (".parq", ".parquet"):
+            import pyarrow.parquet
+
+            with uri.as_local() as local:
+                return pyarrow.parquet.ParquetFile(local.ospath).metadata.num_rows
+        if extension in (".fits", ".fits.gz") and _is_afw_catalog(ref):
+            from lsst.afw.fits import readMetadata
+
+            with uri.as_local() as local:
+                # HDU 1 holds the catalog records; any further HDUs hold
+                # archived objects such as footprints.
+                return readMetadata(local.ospath, hdu=1)["NAXIS2"]
+    if "rowcount" in ref.datasetType.storageClass.allComponents():
+        return butler.get(ref.makeComponentRef("rowcount"))
+    return len(butler.get(ref))
+
+
+class _MemoryBudget:
+    """Bound the total size of the datasets held in memory at once.
+
+    Reservations are granted in the order they were requested, so a
+    reservation for an early dataset cannot be starved by later ones.  A
+    reservation is always granted when nothing else is held, so a single
+    dataset larger than the budget can still be loaded.
+    """
+
+    def __init__(self, limit: int):
+        self._limit = limit
+        self._in_use = 0
+        self._next_ticket = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, ticket: int, size: int):
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._closed or (ticket == self._next_ticket
+                                         and (self._in_use == 0 or self._in_use + size <= self._limit))
+            )
+            if self._closed:
+                raise CancelledError()
+            self._in_use += size
+            self._next_ticket += 1
+            self._condition.notify_all()
+
+    def release(self, size: int):
+        with self._condition:
+            self._in_use -= size
+            self._condition.notify_all()
+
+    def close(self):
+        """Abandon all pending reservations."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+class DatasetLoader:
+    """Read datasets from a butler with a pool of threads.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to read from.
+    max_workers : `int`, optional
+        Number of reader threads.
+    memory_budget : `int`, optional
+        Maximum total size in bytes (estimated from the file sizes) of the
+        datasets that have been read but not yet consumed.  If zero, nothing
+        is read ahead: each dataset is read when it is requested, after the
+        previous one has been released.
+    """
+
+    def __init__(self, butler, max_workers: int = 4, memory_budget: int = 2*1024**3):
+        self.butler = butler
+        self.max_workers = max_workers
+        self.memory_budget = memory_budget
+
+    def _file_size(self, ref) -> int:
+        try:
+            return self.butler.getURI(ref).size()
+        except Exception:
+            # Size is only used for budgeting; disassembled composites and
+            # remote stores without size information count as empty.
+            return 0
+
+    @staticmethod
+    def supports_columns(ref) -> bool:
+        """Return whether a dataset's storage class can read a subset of
+        columns.
+        """
+        return "columns" in ref.datasetType.storageClass.parameters
+
+    def _get(self, ref, columns: Sequence[str] | None, parameters: Mapping | None):
+        parameters = dict(parameters or {})
+        if columns is not None and self.supports_columns(ref):
+            parameters["columns"] = list(columns)
+        return self.butler.get(ref, parameters=parameters or None)
+
+    def iter_get(self, refs: Iterable, columns: Sequence[str] | None = None,
+                 parameters: Mapping | None = None) -> Iterator[tuple]:
+        """Read datasets concurrently, yielding them in order.
+
+        Parameters
+        ----------
+        refs : `~collections.abc.Iterable` [`lsst.daf.butler.DatasetRef`]
+            Datasets to read.
+        columns : `~collections.abc.Sequence` [`str`], optional
+            If not `None`, only read these columns from datasets whose
+            storage class supports it; other datasets are read in full.
+        parameters : `~collections.abc.Mapping`, optional
+            Storage class parameters for all datasets, e.g. ``bbox`` to read
+            a subimage.
+
+        Yields
+        ------
+        ref : `lsst.daf.butler.DatasetRef`
+            Dataset reference.
+        data : `object`
+            The in-memory dataset.  Its share of the memory budget is
+            released when the next dataset is requested, so callers should
+            not hold on to it.
+        """
+        if self.memory_budget <= 0:
+            # File sizes may be unknown (and counted as zero), so do not
+            # rely on the budget to stop the next read from starting early.
+            for ref in refs:
+                data = self._get(ref, columns, parameters)
+                yield ref, data
+                del data
+            return
+
+        refs = list(refs)
+        budget = _MemoryBudget(self.memory_budget)
+
+        def load(ticket, ref):
+            size = self._file_size(ref)
+            budget.acquire(ticket, size)
+            try:
+                return size, self._get(ref, columns, parameters)
+            except BaseException:
+                budget.release(size)
+                raise
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(load, ticket, ref) for ticket, ref in enumerate(refs)]
+            try:
+                for ref, future in zip(refs, futures):
+                    size, data = future.result()
+                    yield ref, data
+                    del data
+                    budget.release(size)
+            finally:
+                for future in futures:
+                    future.cancel()
+                budget.close()
+
+    def iter_row_counts(self, refs: Iterable) -> Iterator[tuple]:
+        """Return the number of rows in tabular datasets, using
+        `read_row_count`.
+
+        Yields
+        ------
+        ref : `lsst.daf.butler.DatasetRef`
+            Dataset reference.
+        count : `int`
+            Number of rows.
+        """
+        refs = list(refs)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            yield from zip(refs, pool.map(lambda ref: read_row_count(self.butler, ref), refs))
@@ -0,0 +1,262 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Run the ci_hsc_gen3 tests in parallel.
+
+Test methods are collected with pytest and assigned to workers with a
+longest-first greedy schedule, using the durations recorded by earlier runs
+as their costs.  The butler, dataset index and other fixtures are cached
+per process, so any worker can run any test method; only classes that set
+up shared state in ``setUpClass`` are kept whole, so that state is not set
+up again by every worker.  Each worker is a pytest process; their JUnit
+reports are merged into one.
+"""
+
+from __future__ import annotations
+
+__all__ = ("collect_tests", "find_rootdir", "find_shared_classes", "main", "merge_reports", "read_durations",
+           "schedule")
+
+import argparse
+import ast
+import heapq
+import json
+import logging
+import os
+import subprocess
+import sys
+import uuid
+import xml.etree.ElementTree as ET
+from collections.abc import Iterable, Mapping, Sequence
+
+from .telemetry import MeasuredProcess
+from .validation_manifest import SESSION_ENV
+
+_LOG = logging.getLogger(__name__)
+
+DEFAULT_COST = 1.0
+"""Cost (in seconds) assumed for tests with no recorded duration, if no
+test has one.
+"""
+
+CONFIG_FILES = ("pytest.ini", "pyproject.toml", "tox.ini", "setup.cfg")
+"""Files whose directory pytest uses as its root directory."""
+
+
+def find_rootdir(paths: Sequence[str]) -> str:
+    """Return the directory that node IDs of tests in ``paths`` are relative
+    to: the nearest directory above them with a pytest config file, or
+    their common directory if there is none.
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    common = os.path.commonpath(paths)
+    if not os.path.isdir(common):
+        common = os.path.dirname(common)
+    directory = common
+    while True:
+        if any(os.path.isfile(os.path.join(directory, name)) for name in CONFIG_FILES):
+            return directory
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return common
+        directory = parent
+
+
+def collect_tests(paths: Sequence[str], rootdir: str) -> list[str]:
+    """Return the pytest node IDs of the test methods in ``paths``,
+    relative to ``rootdir``.
+    """
+    result = subprocess.run([sys.executable, "-m", "pytest", "--collect-only", "-q", f"--rootdir={rootdir}",
+                             *[os.path.abspath(path) for path in paths]],
+                            capture_output=True, text=True, check=True, cwd=rootdir)
+    return [line.strip() for line in result.stdout.splitlines() if "::" in line]
+
+
+def _class_of(node_id: str) -> str:
+    """Return the node ID of the class (or module, for test functions) of a
+    test.
+    """
+    return node_id.rsplit("::", 1)[0]
+
+
+def find_shared_classes(node_ids: Iterable[str], rootdir: str) -> set[str]:
+    """Return the node IDs of the test classes that define ``setUpClass``.
+
+    Parameters
+    ----------
+    node_ids : `~collections.abc.Iterable` [`str`]
+        Node IDs of test methods, relative to ``rootdir``.
+    rootdir : `str`
+        Directory the node IDs are relative to.
+    """
+    shared = set()
+    for path in {node_id.split("::", 1)[0] for node_id in node_ids}:
+        with open(os.path.join(rootdir, path)) as stream:
+            module = ast.parse(stream.read(), filename=path)
+        for node in module.body:
+            if isinstance(node, ast.ClassDef) and any(
+                isinstance(item, ast.FunctionDef) and item.name == "setUpClass" for item in node.body
+            ):
+                shared.add(f"{path}::{node.name}")
+    return shared
+
+
+def schedule(node_ids: Iterable[str], costs: Mapping[str, float], n_workers: int,
+             shared_classes: Iterable[str] = ()) -> list[list[str]]:
+    """Assign tests to workers, longest first, each to the least-loaded
+    worker.
+
+    Parameters
+    ----------
+    node_ids : `~collections.abc.Iterable` [`str`]
+        Tests to run.
+    costs : `~collections.abc.Mapping` [`str`, `float`]
+        Expected duration of each test; tests without one are assumed to
+        take the mean recorded duration.
+    n_workers : `int`
+        Number of workers.
+    shared_classes : `~collections.abc.Iterable` [`str`], optional
+        Node IDs of classes whose tests must all run in the same worker.
+
+    Returns
+    -------
+    assignments : `list` [`list` [`str`]]
+        Tests for each worker that has any, in the order collected.  The
+        cost of a shared class is the sum of the costs of its tests.
+    """
+    node_ids = list(node_ids)
+    shared_classes = set(shared_classes)
+    default = sum(costs.values())/len(costs) if costs else DEFAULT_COST
+    order = {node_id: n for n, node_id in enumerate(node_ids)}
+    units: dict[str, list[str]] = {}
+    for node_id in node_ids:
+        name = _class_of(node_id)
+        units.setdefault(name if name in shared_classes else node_id, []).append(node_id)
+    unit_costs = {name: sum(costs.get(node_id, default) for node_id in tests)
+                  for name, tests in units.items()}
+    loads = [(0.0, worker) for worker in range(max(n_workers, 1))]
+    assignments = [[] for _ in loads]
+    for name in sorted(units, key=lambda name: -unit_costs[name]):
+        load, worker = heapq.heappop(loads)
+        assignments[worker].extend(units[name])
+        heapq.heappush(loads, (load + unit_costs[name], worker))
+    # Keep the tests of each worker in their original order, since some
+    # (e.g. the lsst.utils.tests.MemoryTestCase checks) expect to run after
+    # others.
+    return [sorted(tests, key=order.__getitem__) for tests in assignments if tests]
+
+
+def _testcase_key(testcase: ET.Element) -> str:
+    return f"{testcase.get('classname')}::{testcase.get('name')}"
+
+
+def _node_id_key(node_id: str) -> str:
+    path, *parts = node_id.split("::")
+    module = os.path.splitext(path)[0].replace(os.sep, ".")
+    return ".".join([module, *parts[:-1]]) + "::" + parts[-1]
+
+
+def read_durations(report: str, node_ids: Iterable[str]) -> dict[str, float]:
+    """Return the duration of each test in a JUnit report.
+
+    Parameters
+    ----------
+    report : `str`
+        Path to a JUnit XML report written by pytest.
+    node_ids : `~collections.abc.Iterable` [`str`]
+        Node IDs of the tests to look for.
+
+    Returns
+    -------
+    durations : `dict` [`str`, `float`]
+        Duration in seconds, keyed by node ID.
+    """
+    keys = {_node_id_key(node_id): node_id for node_id in node_ids}
+    durations = {}
+    for testcase in ET.parse(report).getroot().iter("testcase"):
+        node_id = keys.get(_testcase_key(testcase))
+        if node_id is not None:
+            durations[node_id] = float(testcase.get("time", 0.0))
+    return durations
+
+
+def merge_reports(reports: Iterable[str], output: str):
+    """Merge JUnit XML reports into one."""
+    root = ET.Element("testsuites")
+    for report in reports:
+        part = ET.parse(report).getroot()
+        root.extend(part.iter("testsuite") if part.tag == "testsuites" else [part])
+    ET.ElementTree(root).write(output, encoding="utf-8", xml_declaration=True)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``runTests.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Test files or directories.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of worker processes.")
+    parser.add_argument("--junit-xml", required=True, help="Path of the merged JUnit report.")
+    parser.add_argument("--durations", default=None,
+                        help=("JSON file of recorded test durations, used to schedule tests and "
+                              "updated after the run; defaults to durations.json next to the report."))
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    output_dir = os.path.dirname(os.path.abspath(args.junit_xml))
+    os.makedirs(output_dir, exist_ok=True)
+    durations_file = args.durations or os.path.join(output_dir, "durations.json")
+    try:
+        with open(durations_file) as stream:
+            durations = json.load(stream)
+    except FileNotFoundError:
+        durations = {}
+
+    rootdir = find_rootdir(args.paths)
+    node_ids = collect_tests(args.paths, rootdir)
+    shared_classes = find_shared_classes(node_ids, rootdir)
+    assignments = schedule(node_ids, durations, args.jobs, shared_classes)
+    _LOG.info("Running %d tests on %d workers, keeping %d classes with shared set-up whole.",
+              len(node_ids), len(assignments), len(shared_classes))
+
+    # Work around SIP on MacOSX, as bin/sip_safe_python.sh used to.
+    env = dict(os.environ)
+    if "LSST_LIBRARY_PATH" in env:
+        env["DYLD_LIBRARY_PATH"] = env["LSST_LIBRARY_PATH"]
+    # The workers record the datasets that passed the output checks as one
+    # session, so each keeps the others' results.
+    env[SESSION_ENV] = uuid.uuid4().hex
+    reports = [os.path.join(output_dir, f"junit-{worker}.xml") for worker in range(len(assignments))]
+    workers = [
+        MeasuredProcess(f"pytest worker {worker}", "test",
+                        [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", f"--rootdir={rootdir}",
+                         f"--junitxml={report}", *tests], env=env, cwd=rootdir)
+        for worker, (report, tests) in enumerate(zip(reports, assignments))
+    ]
+    returncodes = [worker.wait().returncode for worker in workers]
+
+    reports = [report for report in reports if os.path.exists(report)]
+    merge_reports(reports, args.junit_xml)
+    for report in reports:
+        durations.update(read_durations(report, node_ids))
+        os.remove(report)
+    with open(durations_file, "w") as stream:
+        json.dump(durations, stream, indent=2, sort_keys=True)
+
+    if any(returncode != 0 for returncode in returncodes):
+        sys.exit(1)
@@ -0,0 +1,508 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Staged, resumable driver for the ci_hsc_gen3 pipeline runs.
+
+The processing is split into phases (the main DRP run, source injection,
+post-injection processing, resource-usage gathering and HiPS generation),
+each of which writes to an output collection and depends on the outputs of
+other phases.  Phases whose dependencies have completed are run
+concurrently, and phases that completed in an earlier invocation are
+skipped, so a late failure does not require rerunning everything.
+"""
+
+from __future__ import annotations
+
+__all__ = ("Phase", "PhaseResult", "PipelineDriver", "format_results", "make_phases", "main")
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections.abc import Iterable, Mapping, Sequence
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from .qgraph_cache import QuantumGraphCache, make_cache_key
+from .telemetry import FORK_OPTIONS, Measurement, is_enabled, run_measured
+
+_LOG = logging.getLogger(__name__)
+
+STATE_FILE = "pipeline_state.json"
+"""Name of the file (in the repository root) recording completed phases."""
+
+COLLECTION = "HSC/runs/ci_hsc"
+INPUT_COLLECTION = "HSC/defaults"
+INJECTION_COLLECTION = "HSC/runs/ci_hsc_injection"
+INJECTION_INPUT_COLLECTION = "injection_catalogs"
+RESOURCE_USAGE_COLLECTION = "HSC/runs/ci_hsc_resource_usage"
+HIPS_COLLECTION = "HSC/runs/ci_hsc_hips"
+DATA_QUERY = "skymap='discrete/ci_hsc' AND tract=0 AND patch=69"
+
+
+@dataclass(frozen=True)
+class Phase:
+    """A stage of the pipeline processing.
+
+    A phase either builds a quantum graph (with ``pipetask qgraph``, or with
+    ``build-gather-resource-usage-qg`` if ``gather_resource_usage_of`` is
+    set) and then runs it, or, if ``qgraph_file`` is `None`, runs its
+    pipeline directly with ``pipetask run``.
+    """
+
+    name: str
+    """Name of the phase."""
+
+    output: str
+    """Output collection."""
+
+    inputs: tuple[str, ...] = ()
+    """Input collections; if empty, the output collection is used as input.
+    """
+
+    depends: tuple[str, ...] = ()
+    """Names of the phases that must complete before this one starts."""
+
+    pipeline: str | None = None
+    """Pipeline URI, including any subset labels."""
+
+    data_query: str | None = None
+    """Data ID query expression."""
+
+    config: tuple[str, ...] = ()
+    """Config overrides, in ``label:key=value`` form."""
+
+    qgraph_file: str | None = None
+    """File the quantum graph is saved to."""
+
+    run_options: tuple[str, ...] = ()
+    """Additional options for ``pipetask run``."""
+
+    gather_resource_usage_of: str | None = None
+    """Collection to gather resource usage from."""
+
+    weight: float = 1.0
+    """Relative share of the available processes this phase gets when it
+    runs concurrently with other phases.
+    """
+
+    def _pipetask(self, subcommand: str, repo: str, loglevel: str, mock: bool) -> list[str]:
+        args = ["pipetask", "--long-log", f"--log-level={loglevel}", subcommand,
+                "-b", os.path.join(repo, "butler.yaml")]
+        if self.inputs:
+            args.extend(["--input", ",".join(self.inputs)])
+        args.extend(["--output", self.output])
+        if mock:
+            args.append("--mock")
+        return args
+
+    def _pipeline_args(self) -> list[str]:
+        args = []
+        if self.data_query is not None:
+            args.extend(["-d", self.data_query])
+        args.extend(["-p", self.pipeline])
+        for override in self.config:
+            args.extend(["-c", override])
+        return args
+
+    def qgraph_command(self, repo: str, loglevel: str = "INFO", mock: bool = False) -> list[str] | None:
+        """Return the command that builds this phase's quantum graph, or
+        `None` if the pipeline is run directly.
+        """
+        if self.gather_resource_usage_of is not None:
+            return ["build-gather-resource-usage-qg", "--output", self.output, repo, self.qgraph_file,
+                    self.gather_resource_usage_of]
+        if self.qgraph_file is None:
+            return None
+        return (self._pipetask("qgraph", repo, loglevel, mock) + self._pipeline_args()
+                + ["--save-qgraph", self.qgraph_file])
+
+    def run_command(self, repo: str, jobs: int, loglevel: str = "INFO", mock: bool = False) -> list[str]:
+        """Return the command that runs this phase."""
+        args = self._pipetask("run", repo, loglevel, mock and self.gather_resource_usage_of is None)
+        args.extend(["-j", str(jobs), *self.run_options, "--register-dataset-types"])
+        if self.qgraph_file is not None:
+            args.extend(["--qgraph", self.qgraph_file])
+        else:
+            args.extend(self._pipeline_args())
+        return args
+
+
+def make_phases(repo: str) -> list[Phase]:
+    """Return the phases of the ci_hsc_gen3 processing.
+
+    Parameters
+    ----------
+    repo : `str`
+        Root of the data repository.
+    """
+    from lsst.utils import getPackageDir
+
+    drp_pipe_dir = getPackageDir("drp_pipe")
+    ci_hsc_gen3_dir = getPackageDir("ci_hsc_gen3")
+    return [
+        Phase(
+            "drp",
+            COLLECTION,
+            inputs=(INPUT_COLLECTION,),
+            pipeline=os.path.join(drp_pipe_dir, "pipelines", "HSC", "DRP-ci_hsc.yaml"),
+            data_query=DATA_QUERY,
+            config=("calibrateImage:astrometry.maxMeanDistanceArcsec=0.02",
+                    "makeDirectWarp:select.maxPsfTraceRadiusDelta=0.2"),
+            qgraph_file="ci_hsc.qg",
+            run_options=("--no-raise-on-partial-outputs",),
+        ),
+        Phase(
+            "injection",
+            INJECTION_COLLECTION,
+            inputs=(COLLECTION, INJECTION_INPUT_COLLECTION),
+            depends=("drp",),
+            pipeline=(os.path.join(repo, "DRP-ci_hsc+injection.yaml")
+                      + "#injected_coaddition,injected_multiband,injected_objectTable,injected_forced,"
+                      "injected_analysis_tools"),
+            data_query=DATA_QUERY,
+            qgraph_file="ci_hsc_injection.qg",
+            weight=2.0,
+        ),
+        Phase(
+            "post_injection",
+            INJECTION_COLLECTION,
+            depends=("injection",),
+            pipeline=os.path.join(drp_pipe_dir, "pipelines", "HSC", "DRP-ci_hsc-post-injected.yaml"),
+            data_query=DATA_QUERY,
+            qgraph_file="ci_hsc_post_injection.qg",
+        ),
+        Phase(
+            "resource_usage",
+            RESOURCE_USAGE_COLLECTION,
+            depends=("drp",),
+            qgraph_file="ci_hsc_resource_usage.qg",
+            gather_resource_usage_of=COLLECTION,
+        ),
+        Phase(
+            "hips",
+            HIPS_COLLECTION,
+            inputs=(COLLECTION,),
+            depends=("drp",),
+            pipeline=os.path.join(ci_hsc_gen3_dir, "resources", "hips.yaml"),
+            config=(f"generateHips:hips_base_uri={repo}/hips",
+                    f"generateColorHips:hips_base_uri={repo}/hips"),
+        ),
+    ]
+
+
+@dataclass
+class PhaseResult:
+    """Outcome of a phase."""
+
+    name: str
+    status: str = "pending"
+    """One of ``pending``, ``skipped``, ``succeeded`` or ``failed``."""
+
+    returncode: int | None = None
+    jobs: int = 0
+    elapsed: float = 0.0
+    commands: list[list[str]] = field(default_factory=list)
+    measurements: list[Measurement] = field(default_factory=list)
+    """Resources used by each command run."""
+
+    @property
+    def cpu_time(self) -> float:
+        """Total CPU time in seconds of the phase's commands."""
+        return sum(measurement.cpu_time for measurement in self.measurements)
+
+    @property
+    def max_rss(self) -> int:
+        """Peak resident set size in bytes of the phase's commands."""
+        return max((measurement.max_rss for measurement in self.measurements), default=0)
+
+
+class PipelineDriver:
+    """Run a set of phases, respecting their dependencies.
+
+    Parameters
+    ----------
+    repo : `str`
+        Root of the data repository.
+    phases : `~collections.abc.Sequence` [`Phase`]
+        Phases to run.
+    jobs : `int`, optional
+        Total number of processes for ``pipetask run``; phases that run
+        concurrently share them according to their weights.
+    phase_jobs : `~collections.abc.Mapping` [`str`, `int`], optional
+        Number of processes for specific phases, overriding the share of
+        ``jobs`` they would otherwise get.
+    loglevel : `str`, optional
+        Logging level passed to ``pipetask``.
+    mock : `bool`, optional
+        Whether to run mock pipelines.
+    resume : `bool`, optional
+        Whether to skip phases that completed in an earlier invocation.
+    qgraph_cache : `QuantumGraphCache`, optional
+        Cache of quantum graphs to reuse instead of running
+        ``pipetask qgraph``.
+    """
+
+    def __init__(self, repo: str, phases: Sequence[Phase], *, jobs: int = 1,
+                 phase_jobs: Mapping[str, int] | None = None, loglevel: str = "INFO", mock: bool = False,
+                 resume: bool = True, qgraph_cache: QuantumGraphCache | None = None):
+        self.repo = repo
+        self.phases = {phase.name: phase for phase in phases}
+        for phase in phases:
+            for dependency in phase.depends:
+                if dependency not in self.phases:
+                    raise ValueError(f"Phase {phase.name!r} depends on unknown phase {dependency!r}.")
+        self.jobs = jobs
+        self.phase_jobs = dict(phase_jobs or {})
+        self.loglevel = loglevel
+        self.mock = mock
+        self.resume = resume
+        self.qgraph_cache = qgraph_cache
+        self._state_file = os.path.join(repo, STATE_FILE)
+
+    def _read_state(self) -> dict[str, str]:
+        try:
+            with open(self._state_file) as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+
+    def _write_state(self, state: Mapping[str, str]):
+        with open(self._state_file, "w") as stream:
+            json.dump(state, stream, indent=2)
+
+    def _make_butler(self):
+        from lsst.daf.butler import Butler
+
+        # A new butler each time, since the registry caches collection
+        # records and the collections are modified by other processes.
+        return Butler.from_config(self.repo, writeable=False)
+
+    def _is_complete(self, state: Mapping[str, str], name: str) -> bool:
+        """Return whether a phase completed in an earlier invocation and its
+        output run still exists.
+        """
+        from lsst.daf.butler import MissingCollectionError
+
+        if name not in state:
+            return False
+        try:
+            self._make_butler().registry.getCollectionType(state[name])
+        except MissingCollectionError:
+            return False
+        return True
+
+    def _output_run(self, phase: Phase) -> str:
+        """Return the run collection most recently added to a phase's output
+        chain.
+        """
+        return self._make_butler().registry.getCollectionChain(phase.output)[0]
+
+    def allocate_jobs(self, names: Sequence[str], available: int) -> dict[str, int]:
+        """Divide processes between phases that start together.
+
+        Parameters
+        ----------
+        names : `~collections.abc.Sequence` [`str`]
+            Names of the phases being started.
+        available : `int`
+            Number of processes not in use by already-running phases.
+
+        Returns
+        -------
+        jobs : `dict` [`str`, `int`]
+            Number of processes for each phase; always at least one.
+        """
+        jobs = {name: self.phase_jobs[name] for name in names if name in self.phase_jobs}
+        shared = [name for name in names if name not in jobs]
+        if not shared:
+            return jobs
+        available = max(available - sum(jobs.values()), len(shared))
+        total_weight = sum(self.phases[name].weight for name in shared)
+        for name in shared:
+            jobs[name] = max(int(available*self.phases[name].weight/total_weight), 1)
+        # Give any processes lost to rounding to the heaviest phase.
+        heaviest = max(shared, key=lambda name: self.phases[name].weight)
+        jobs[heaviest] += max(available - sum(jobs[name] for name in shared), 0)
+        return jobs
+
+    def _cache_key(self, phase: Phase) -> str | None:
+        """Return the quantum graph cache key for a phase, or `None` if its
+        graph should not be cached.
+
+        Graphs of phases that depend on others are not cached, since their
+        inputs are new datasets every time the phases upstream run.
+        """
+        if (self.qgraph_cache is None or phase.qgraph_file is None or phase.gather_resource_usage_of
+                or phase.depends):
+            return None
+        return make_cache_key(self._make_butler(), phase.pipeline, phase.config, phase.data_query,
+                              phase.inputs or (phase.output,), mock=self.mock)
+
+    def _call(self, phase: Phase, result: PhaseResult, kind: str, command: list[str]) -> bool:
+        _LOG.info("Phase %s: %s", phase.name, " ".join(command))
+        result.commands.append(command)
+        measurement = run_measured(phase.name, kind, command)
+        result.measurements.append(measurement)
+        result.returncode = measurement.returncode
+        if result.returncode != 0:
+            result.status = "failed"
+            return False
+        return True
+
+    def _run_commands(self, phase: Phase, result: PhaseResult):
+        qgraph_command = phase.qgraph_command(self.repo, self.loglevel, self.mock)
+        key = self._cache_key(phase) if qgraph_command is not None else None
+        if key is not None and self.qgraph_cache.fetch(key, self._make_butler(), phase.qgraph_file):
+            qgraph_command = None
+        if qgraph_command is not None:
+            if not self._call(phase, result, "qgraph", qgraph_command):
+                return
+            if key is not None:
+                self.qgraph_cache.store(key, phase.qgraph_file)
+        run_command = phase.run_command(self.repo, result.jobs, self.loglevel, self.mock)
+        if is_enabled():
+            # Only forked workers have their registry queries counted.
+            run_command.extend(FORK_OPTIONS)
+        if self._call(phase, result, "run", run_command):
+            result.status = "succeeded"
+
+    def _run_phase(self, phase: Phase, result: PhaseResult) -> PhaseResult:
+        start = time.time()
+        try:
+            self._run_commands(phase, result)
+        except Exception:
+            # E.g. the graph cache or registry; report it as a failure of
+            # this phase rather than stopping the phases running with it.
+            _LOG.exception("Phase %s raised an exception.", phase.name)
+            result.status = "failed"
+        result.elapsed = time.time() - start
+        return result
+
+    def run(self) -> dict[str, PhaseResult]:
+        """Run all phases.
+
+        Returns
+        -------
+        results : `dict` [`str`, `PhaseResult`]
+            Outcome of each phase.  Phases downstream of a failure are left
+            ``pending``; phases that do not depend on it still run.
+
+        Notes
+        -----
+        A phase is only skipped if it completed earlier and so did all of
+        its dependencies, since its outputs are stale once any phase
+        upstream of it is rerun.
+        """
+        state = self._read_state() if self.resume else {}
+        results = {name: PhaseResult(name) for name in self.phases}
+        complete = {name: self._is_complete(state, name) for name in self.phases}
+        skipped: dict[str, bool] = {}
+
+        def is_skipped(name):
+            if name not in skipped:
+                skipped[name] = complete[name] and all(is_skipped(dependency)
+                                                       for dependency in self.phases[name].depends)
+            return skipped[name]
+
+        for name in self.phases:
+            if is_skipped(name):
+                _LOG.info("Phase %s already completed in %s; skipping.", name, state[name])
+                results[name].status = "skipped"
+            elif complete[name]:
+                _LOG.info("Phase %s completed in %s, but a phase it depends on has to be rerun.", name,
+                          state[name])
+
+        def is_done(name):
+            return results[name].status in ("skipped", "succeeded")
+
+        # A failed phase is never done, so the phases downstream of it are
+        # never ready and stay pending, while independent ones carry on.
+        running = {}
+        with ThreadPoolExecutor(max_workers=max(len(self.phases), 1)) as pool:
+            while True:
+                ready = [
+                    name for name, phase in self.phases.items()
+                    if (results[name].status == "pending" and name not in running.values()
+                        and all(is_done(dependency) for dependency in phase.depends))
+                ]
+                in_use = sum(results[name].jobs for name in running.values())
+                for name, jobs in self.allocate_jobs(ready, self.jobs - in_use).items():
+                    results[name].jobs = jobs
+                    running[pool.submit(self._run_phase, self.phases[name], results[name])] = name
+                if len(ready) > 1:
+                    _LOG.info("Running phases %s concurrently with %s processes.", ", ".join(ready),
+                              "/".join(str(results[name].jobs) for name in ready))
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    result = future.result()
+                    if result.status == "succeeded":
+                        state[name] = self._output_run(self.phases[name])
+                        self._write_state(state)
+                    else:
+                        _LOG.error("Phase %s failed (exit code %s).", name, result.returncode)
+        return results
+
+
+def format_results(results: Mapping[str, PhaseResult]) -> str:
+    """Format the outcome of all phases as a table."""
+    lines = [f"{'phase':<16} {'status':<10} {'jobs':>4} {'elapsed':>10} {'cpu':>10} {'max rss':>10}"]
+    for result in results.values():
+        lines.append(f"{result.name:<16} {result.status:<10} {result.jobs or '':>4} {result.elapsed:9.1f}s "
+                     f"{result.cpu_time:9.1f}s {result.max_rss/1024**3:7.2f}GiB")
+    return "\n".join(lines)
+
+
+def _parse_phase_jobs(value: str) -> tuple[str, int]:
+    name, _, jobs = value.partition("=")
+    return name, int(jobs)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``runPipeline.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the data repository.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help=("Run pipetask with this many processes in total, shared between "
+                              "concurrent phases; default is 1."))
+    parser.add_argument("--phase-jobs", type=_parse_phase_jobs, action="append", default=[],
+                        metavar="PHASE=N", help="Number of processes for a specific phase.")
+    parser.add_argument("-l", "--log-level", default="INFO", help="Logging level, default is INFO.")
+    parser.add_argument("-m", "--mock", action="store_true", help="Run mock pipelines.")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="Rerun phases that completed in an earlier invocation.")
+    parser.add_argument("--qgraph-cache", default=None, metavar="DIR",
+                        help="Directory of quantum graphs to reuse when their inputs are unchanged.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level)
+    driver = PipelineDriver(args.repo, make_phases(args.repo), jobs=args.jobs,
+                            phase_jobs=dict(args.phase_jobs), loglevel=args.log_level, mock=args.mock,
+                            resume=args.resume,
+                            qgraph_cache=QuantumGraphCache(args.qgraph_cache) if args.qgraph_cache else None)
+    results = driver.run()
+    print(format_results(results))
+    if not all(result.status in ("skipped", "succeeded") for result in results.values()):
+        sys.exit(1)
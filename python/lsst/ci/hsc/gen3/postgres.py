@@ -0,0 +1,201 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""A throwaway PostgreSQL server for the registry of the data repository.
+
+`LocalPostgres` creates a database cluster in a directory with ``initdb``
+and runs it with ``pg_ctl``, listening only on ``localhost`` on a free
+port, with trust authentication for the current user.  The cluster is
+meant to live inside the data repository root, so ``scons --clean``
+removes it with the rest of the repository.
+"""
+
+from __future__ import annotations
+
+__all__ = ("DATABASE", "LocalPostgres", "main", "write_seed_config")
+
+import argparse
+import getpass
+import logging
+import os
+import socket
+import subprocess
+from collections.abc import Iterable
+
+import yaml
+
+_LOG = logging.getLogger(__name__)
+
+DATABASE = "ci_hsc_gen3"
+"""Name of the database holding the registry of the data repository."""
+
+EXTENSIONS = ("btree_gist",)
+"""Extensions the registry needs for the exclusion constraints on calibration
+validity ranges.
+"""
+
+SERVER_OPTIONS = ("-c listen_addresses=localhost", "-c unix_socket_directories=''", "-c max_connections=200")
+"""Options of the server besides its port.  Clients connect over TCP only,
+since the path of a socket in the repository may be too long; pipetask
+workers each hold their own connections.
+"""
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+class LocalPostgres:
+    """A PostgreSQL server with its data in a local directory.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory holding the cluster, its port and its log.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.data_dir = os.path.join(self.root, "data")
+        self.user = getpass.getuser()
+
+    @property
+    def port(self) -> int:
+        """Port the server listens on, chosen when the cluster is created."""
+        with open(os.path.join(self.root, "port")) as stream:
+            return int(stream.read())
+
+    def url(self, database: str = DATABASE) -> str:
+        """Return the SQLAlchemy URL of a database on the server."""
+        return f"postgresql://{self.user}@localhost:{self.port}/{database}"
+
+    def _run(self, *args: str, **kwargs) -> subprocess.CompletedProcess:
+        return subprocess.run(args, check=True, capture_output=True, text=True, **kwargs)
+
+    def _psql(self, sql: str, database: str = "postgres") -> str:
+        return self._run("psql", "-h", "localhost", "-p", str(self.port), "-U", self.user, "-d", database,
+                         "-X", "-q", "-t", "-A", "-v", "ON_ERROR_STOP=1", "-c", sql).stdout.strip()
+
+    def initialize(self):
+        """Create the cluster, unless it exists."""
+        if os.path.exists(os.path.join(self.data_dir, "PG_VERSION")):
+            return
+        os.makedirs(self.root, exist_ok=True)
+        _LOG.info("Creating a PostgreSQL cluster in %s.", self.data_dir)
+        self._run("initdb", "-D", self.data_dir, "-U", self.user, "--auth=trust", "--encoding=UTF8",
+                  "--no-sync")
+        with open(os.path.join(self.root, "port"), "w") as stream:
+            stream.write(str(_free_port()))
+
+    def is_running(self) -> bool:
+        """Return whether the server is running."""
+        if not os.path.exists(os.path.join(self.data_dir, "PG_VERSION")):
+            return False
+        return subprocess.run(["pg_ctl", "status", "-D", self.data_dir],
+                              capture_output=True).returncode == 0
+
+    def start(self, databases: Iterable[str] = (DATABASE,)) -> bool:
+        """Start the server, creating the cluster and databases as needed.
+
+        Parameters
+        ----------
+        databases : `~collections.abc.Iterable` [`str`], optional
+            Databases to create if they do not exist.
+
+        Returns
+        -------
+        started : `bool`
+            Whether the server was started, rather than already running.
+        """
+        self.initialize()
+        started = not self.is_running()
+        if started:
+            options = " ".join((f"-p {self.port}", *SERVER_OPTIONS))
+            _LOG.info("Starting PostgreSQL on localhost:%d.", self.port)
+            self._run("pg_ctl", "start", "-w", "-D", self.data_dir,
+                      "-l", os.path.join(self.root, "server.log"), "-o", options)
+        for database in databases:
+            self.create_database(database)
+        return started
+
+    def stop(self):
+        """Stop the server, if it is running."""
+        if self.is_running():
+            _LOG.info("Stopping PostgreSQL on localhost:%d.", self.port)
+            self._run("pg_ctl", "stop", "-w", "-m", "fast", "-D", self.data_dir)
+
+    def create_database(self, database: str):
+        """Create a database for a registry, unless it exists."""
+        if not self._psql(f"SELECT 1 FROM pg_database WHERE datname = '{database}'"):
+            self._psql(f'CREATE DATABASE "{database}"')
+        for extension in EXTENSIONS:
+            self._psql(f"CREATE EXTENSION IF NOT EXISTS {extension}", database=database)
+
+    def drop_database(self, database: str):
+        """Drop a database, if it exists."""
+        self._psql(f'DROP DATABASE IF EXISTS "{database}"')
+
+
+def write_seed_config(path: str, url: str, seed: str | None = None):
+    """Write a butler seed config whose registry is a PostgreSQL database.
+
+    Parameters
+    ----------
+    path : `str`
+        Config file to write.
+    url : `str`
+        SQLAlchemy URL of the database, from `LocalPostgres.url`.
+    seed : `str`, optional
+        Seed config to start from, e.g. ``configs/butler-seed.yaml``.
+    """
+    config = {}
+    if seed:
+        with open(seed) as stream:
+            config = yaml.safe_load(stream) or {}
+    config.setdefault("registry", {})["db"] = url
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as stream:
+        yaml.safe_dump(config, stream)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``localPostgres.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=("start", "stop"), help="Start or stop the server.")
+    parser.add_argument("root", help="Directory holding the cluster.")
+    parser.add_argument("--database", default=DATABASE,
+                        help=f"Database created when starting the server; default is {DATABASE}.")
+    parser.add_argument("--seed-config", default=None,
+                        help="Seed config extended with the registry URL written to --write-seed.")
+    parser.add_argument("--write-seed", default=None, metavar="PATH",
+                        help="Write a butler seed config pointing at the database when starting.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = LocalPostgres(args.root)
+    if args.action == "start":
+        server.start([args.database])
+        if args.write_seed:
+            write_seed_config(args.write_seed, server.url(args.database), args.seed_config)
+        print(server.url(args.database))
+    else:
+        server.stop()
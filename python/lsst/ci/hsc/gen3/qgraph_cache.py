@@ -0,0 +1,167 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Content-addressed cache of saved quantum graphs.
+
+A graph is stored under a key that hashes everything that goes into
+building it: the expanded pipeline definition, the config overrides, the
+data query, the versions of the set-up packages and the datasets in the
+input collections.  Because saved graphs hold resolved output references,
+a cached graph can only be reused if its output run does not exist in the
+repository yet (e.g. after the repository was rebuilt from identical inputs
+or the run was removed).
+
+Saved graphs also refer to their inputs by dataset ID, so the input
+datasets are identified by ID rather than data ID: a graph is only valid
+for a repository holding the very same datasets.  Rebuilding the
+repository gives new IDs to the raws and to the imported datasets that have
+integer IDs in their exports, so graphs are only reused when the
+repository is restored from a snapshot (see
+`~lsst.ci.hsc.gen3.repo_snapshot`) or was not rebuilt.  For the same
+reason, graphs whose inputs are written by earlier phases of the same
+build, which get new IDs on every run, are not cached at all.
+"""
+
+from __future__ import annotations
+
+__all__ = ("QuantumGraphCache", "fingerprint_collections", "make_cache_key")
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections.abc import Iterable
+
+_LOG = logging.getLogger(__name__)
+
+
+def fingerprint_collections(butler, collections: Iterable[str]) -> str:
+    """Return a digest of the datasets in a set of collections.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler for the repository.
+    collections : `~collections.abc.Iterable` [`str`]
+        Collections to fingerprint; chains are flattened.
+
+    Returns
+    -------
+    digest : `str`
+        Hex digest of the names and types of the (flattened) collections
+        and the IDs of the datasets in them.
+    """
+    digest = hashlib.sha256()
+    for name in butler.registry.queryCollections(list(collections), flattenChains=True,
+                                                 includeChains=False):
+        digest.update(f"{name}:{butler.registry.getCollectionType(name).name}\n".encode())
+        for dataset_id in sorted(str(ref.id) for ref in butler.registry.queryDatasets(..., collections=name)):
+            digest.update(dataset_id.encode())
+    return digest.hexdigest()
+
+
+def make_cache_key(butler, pipeline: str, config: Iterable[str], data_query: str | None,
+                   collections: Iterable[str], mock: bool = False) -> str:
+    """Return the cache key for a quantum graph.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler for the repository.
+    pipeline : `str`
+        Pipeline URI, including any subset labels.
+    config : `~collections.abc.Iterable` [`str`]
+        Config overrides.
+    data_query : `str` or `None`
+        Data ID query expression.
+    collections : `~collections.abc.Iterable` [`str`]
+        Input collections.
+    mock : `bool`, optional
+        Whether the graph is for a mock pipeline.
+    """
+    from lsst.pipe.base import Pipeline
+    from lsst.utils.packages import getEnvironmentPackages
+
+    content = {
+        "pipeline": str(Pipeline.from_uri(pipeline)),
+        "config": list(config),
+        "data_query": data_query,
+        "mock": mock,
+        "packages": sorted(getEnvironmentPackages(include_all=True).items()),
+        "inputs": fingerprint_collections(butler, collections),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class QuantumGraphCache:
+    """A directory of saved quantum graphs, indexed by cache key.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory holding the cached graphs.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        return os.path.join(self.root, f"{key}.qg"), os.path.join(self.root, f"{key}.json")
+
+    def fetch(self, key: str, butler, destination: str) -> bool:
+        """Copy a cached graph to ``destination`` if one exists for ``key``
+        and its output run is not already in the repository.
+
+        Returns
+        -------
+        found : `bool`
+            Whether a usable graph was found.
+        """
+        from lsst.daf.butler import MissingCollectionError
+
+        graph_path, info_path = self._paths(key)
+        if not os.path.exists(graph_path) or not os.path.exists(info_path):
+            return False
+        with open(info_path) as stream:
+            output_run = json.load(stream)["output_run"]
+        try:
+            butler.registry.getCollectionType(output_run)
+        except MissingCollectionError:
+            pass
+        else:
+            _LOG.info("Cached graph %s writes to existing run %s; not reusing it.", key, output_run)
+            return False
+        shutil.copyfile(graph_path, destination)
+        _LOG.info("Reusing cached quantum graph %s for %s.", key, destination)
+        return True
+
+    def store(self, key: str, source: str):
+        """Add a saved graph to the cache."""
+        from lsst.pipe.base import QuantumGraph
+
+        os.makedirs(self.root, exist_ok=True)
+        graph_path, info_path = self._paths(key)
+        # Only the header is needed to find the output run.
+        output_run = QuantumGraph.loadUri(source, nodes=[]).metadata["output_run"]
+        shutil.copyfile(source, graph_path + ".tmp")
+        os.replace(graph_path + ".tmp", graph_path)
+        with open(info_path, "w") as stream:
+            json.dump({"output_run": output_run}, stream)
@@ -0,0 +1,240 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Ingest of the raw exposures of the ci_hsc_gen3 repository, using cached
+indexes of their translated metadata.
+
+Most of the time of a raw ingest goes into reading the FITS headers and
+translating them into `~astro_metadata_translator.ObservationInfo`.  Before
+ingesting, the headers of every raw directory are translated in parallel
+and written to a ``_index.json`` index file in a cache directory, under a
+key that hashes the paths, sizes and modification times of the raws and
+the versions of the translation code.  The index files are passed to
+`~lsst.obs.base.RawIngestTask` with the raws, which then takes the metadata
+from them instead of opening the raws, so later builds with the same raws
+do not read any headers at all.
+"""
+
+from __future__ import annotations
+
+__all__ = ("RAW_COLLECTION", "RawIndexCache", "ingest_raws", "main", "make_command_args", "make_parser")
+
+import argparse
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import re
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+
+from .transfer import TRANSFER_MODES, butler_transfer_mode, survey_tree
+
+_LOG = logging.getLogger(__name__)
+
+RAW_COLLECTION = "HSC/raw/all"
+"""Run the raws are ingested into."""
+
+INDEX_FILENAME = "_index.json"
+"""Name of the index files read by `~lsst.obs.base.RawIngestTask`."""
+
+RAW_FILE_PATTERN = re.compile(r"\.fit[s]?\b")
+"""Pattern matching the names of raw files (the default ``file_filter`` of
+`~lsst.obs.base.RawIngestConfig`).
+"""
+
+TRANSLATION_PACKAGES = ("astro_metadata_translator", "obs_subaru")
+"""Packages whose versions determine the translated metadata."""
+
+
+def _find_raws(raw_root: str) -> dict[str, list[str]]:
+    """Return the absolute paths of the raw files under a directory,
+    grouped by directory.
+    """
+    raws = {}
+    for dirpath, dirnames, filenames in os.walk(os.path.abspath(raw_root)):
+        dirnames.sort()
+        files = sorted(os.path.join(dirpath, name) for name in filenames if RAW_FILE_PATTERN.search(name))
+        if files:
+            raws[dirpath] = files
+    return raws
+
+
+def _translate(path: str) -> tuple[str, dict | None]:
+    """Read and translate the headers of one raw file, returning `None` if
+    they cannot be translated.
+    """
+    from astro_metadata_translator.file_helpers import read_file_info
+
+    # Header number -1 merges the primary header with the first extension.
+    return path, read_file_info(path, -1, content_mode="translated", content_type="simple")
+
+
+class RawIndexCache:
+    """A directory of index files of translated raw metadata.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory holding the index files.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    @staticmethod
+    def _versions() -> dict[str, str | None]:
+        from lsst.utils.packages import getEnvironmentPackages
+
+        versions = getEnvironmentPackages(include_all=True)
+        for name in TRANSLATION_PACKAGES:
+            if name not in versions:
+                # Not set up with EUPS; use the version of the Python
+                # distribution instead.
+                try:
+                    versions[name] = importlib.metadata.version(name.replace("_", "-"))
+                except importlib.metadata.PackageNotFoundError:
+                    pass
+        return {name: versions.get(name) for name in TRANSLATION_PACKAGES}
+
+    def _path(self, files: Iterable[str], versions: dict) -> str:
+        digest = hashlib.sha256(json.dumps(versions, sort_keys=True).encode())
+        for path in files:
+            stat = os.stat(path)
+            digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+        return os.path.join(self.root, digest.hexdigest(), INDEX_FILENAME)
+
+    def index(self, raw_root: str, num_workers: int = 1) -> list[str]:
+        """Return index files for all raws under a directory, writing the
+        ones that are not in the cache.
+
+        Parameters
+        ----------
+        raw_root : `str`
+            Directory of the raws.
+        num_workers : `int`, optional
+            Number of processes used to translate headers.
+
+        Returns
+        -------
+        index_files : `list` [`str`]
+            One index file per directory of raws.  The file paths in them
+            are absolute.
+        """
+        from astro_metadata_translator.indexing import calculate_index
+
+        versions = self._versions()
+        index_files = {self._path(files, versions): files for files in _find_raws(raw_root).values()}
+        missing = {path: files for path, files in index_files.items() if not os.path.exists(path)}
+        if missing:
+            to_translate = [raw for files in missing.values() for raw in files]
+            _LOG.info("Translating the headers of %d raws in %d directories.", len(to_translate),
+                      len(missing))
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                translated = dict(pool.map(_translate, to_translate,
+                                           chunksize=max(1, len(to_translate)//(4*num_workers))))
+            for path, files in missing.items():
+                content = {raw: translated[raw] for raw in files if translated[raw] is not None}
+                if len(content) < len(files):
+                    # Raws missing from an index are read by the ingest
+                    # itself, which reports why they cannot be ingested.
+                    _LOG.warning("Could not translate %d raws in %s.", len(files) - len(content),
+                                 os.path.dirname(files[0]))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f"{path}.{os.getpid()}", "w") as stream:
+                    json.dump(calculate_index(content, "translated"), stream)
+                os.replace(f"{path}.{os.getpid()}", path)
+        _LOG.info("Using %d cached raw index files (%d new).", len(index_files), len(missing))
+        return list(index_files)
+
+
+def ingest_raws(butler, repo_root: str, raw_root: str, *, index_cache: str | None = None,
+                transfer: str = "hardlink", num_workers: int = 1):
+    """Ingest the raws into the repository.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler for the repository.
+    repo_root : `str`
+        Root of the data repository, which must also be the root of its
+        file datastore.
+    raw_root : `str`
+        Directory of the raws.
+    index_cache : `str`, optional
+        Directory of cached index files; if `None`, the headers are read by
+        the ingest itself.
+    transfer : `str`, optional
+        One of `~lsst.ci.hsc.gen3.transfer.TRANSFER_MODES`.
+    num_workers : `int`, optional
+        Number of processes used to translate headers and ingest.
+    """
+    from lsst.obs.base import RawIngestConfig, RawIngestTask
+
+    files = [raw_root]
+    if index_cache:
+        files.extend(RawIndexCache(index_cache).index(raw_root, num_workers=num_workers))
+    config = RawIngestConfig()
+    config.transfer = butler_transfer_mode(transfer, raw_root, repo_root)
+    _LOG.info("Ingesting raws from %s (transfer mode %s).", raw_root, config.transfer)
+    RawIngestTask(config=config, butler=butler).run(files, processes=num_workers, run=RAW_COLLECTION)
+    if transfer != "direct":
+        _LOG.info("Transferred raws: %s.", survey_tree(os.path.join(repo_root, RAW_COLLECTION)))
+
+
+def make_parser() -> argparse.ArgumentParser:
+    """Return the argument parser of ``ingestRaws.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the data repository.")
+    parser.add_argument("raw_root", help="Directory of the raws.")
+    parser.add_argument("--raw-index-cache", default=None,
+                        help="Directory of cached index files of translated raw metadata.")
+    parser.add_argument("--transfer", choices=TRANSFER_MODES, default="hardlink",
+                        help="How raws are transferred into the repository; default is hardlink.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used to translate headers and ingest.")
+    return parser
+
+
+def make_command_args(repo: str, raw_root: str, *, raw_index_cache: str | None = None,
+                      transfer: str = "hardlink", jobs: int = 1) -> list[str]:
+    """Return the arguments of an ``ingestRaws.py`` command, as built by the
+    SConstruct.
+
+    Parameters are as for `ingest_raws`, and ``jobs`` is its
+    ``num_workers``.
+    """
+    args = [repo, raw_root, "--transfer", transfer, "-j", str(jobs)]
+    if raw_index_cache:
+        args.extend(["--raw-index-cache", raw_index_cache])
+    return args
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``ingestRaws.py``."""
+    args = make_parser().parse_args(argv)
+
+    from lsst.daf.butler import Butler
+
+    logging.basicConfig(level=logging.INFO)
+    butler = Butler.from_config(args.repo, writeable=True)
+    ingest_raws(butler, args.repo, args.raw_root, index_cache=args.raw_index_cache, transfer=args.transfer,
+                num_workers=args.jobs)
@@ -0,0 +1,361 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Compare the registry time of the DRP run on SQLite and PostgreSQL.
+
+The quantum graph of the main DRP run (``ci_hsc.qg``) is run with the same
+number of processes against two fresh repositories, one with a SQLite
+registry and one with a registry in a local PostgreSQL server (see
+`~lsst.ci.hsc.gen3.postgres`).  Each repository holds only the overall
+inputs of the graph, transferred from the ci_hsc_gen3 repository with hard
+links where possible, the collections they belong to, and the dimension
+records of every data ID in the graph (outputs included).  ``pipetask run``
+is measured with `~lsst.ci.hsc.gen3.telemetry`, which times the SQL
+statements executed by pipetask and its (forked) workers, and the results
+are reported as wall time and registry time per quantum; per-quantum
+figures are only reported for runs that succeeded.
+"""
+
+from __future__ import annotations
+
+__all__ = ("BACKENDS", "BackendResult", "clone_inputs", "format_results", "main", "run_registry_benchmark")
+
+import argparse
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import sys
+from collections import defaultdict
+from collections.abc import Iterable, Sequence
+
+from .pipeline import make_phases
+from .postgres import LocalPostgres, write_seed_config
+from .telemetry import FORK_OPTIONS, run_measured
+
+_LOG = logging.getLogger(__name__)
+
+BACKENDS = ("sqlite", "postgresql")
+"""Registry backends compared, in the order they are run."""
+
+DATABASE = "ci_hsc_gen3_registry_benchmark"
+"""PostgreSQL database of the benchmark repository."""
+
+
+@dataclasses.dataclass
+class BackendResult:
+    """Outcome of the run on one registry backend."""
+
+    backend: str
+    """Name of the backend, one of `BACKENDS`."""
+
+    quanta: int
+    """Number of quanta in the graph."""
+
+    jobs: int
+    """Number of pipetask processes."""
+
+    returncode: int
+    """Exit status of ``pipetask run``."""
+
+    wall_time: float
+    """Wall time of ``pipetask run``, in seconds."""
+
+    registry_time: float | None
+    """Time spent in registry SQL statements, summed over processes, in
+    seconds.
+    """
+
+    registry_queries: int | None
+    """Number of registry SQL statements."""
+
+    @property
+    def succeeded(self) -> bool:
+        """Whether ``pipetask run`` ran every quantum successfully."""
+        return self.returncode == 0
+
+    @property
+    def registry_time_per_quantum(self) -> float | None:
+        """Registry time per quantum, in seconds, or `None` if the run
+        failed (and so did not run every quantum).
+        """
+        if not self.succeeded or self.registry_time is None:
+            return None
+        return self.registry_time/self.quanta
+
+    @property
+    def queries_per_quantum(self) -> float | None:
+        """Number of registry SQL statements per quantum, or `None` if the
+        run failed.
+        """
+        if not self.succeeded or self.registry_queries is None:
+            return None
+        return self.registry_queries/self.quanta
+
+    def to_dict(self) -> dict:
+        """Return the result as a JSON-compatible dictionary."""
+        return dict(dataclasses.asdict(self), registry_time_per_quantum=self.registry_time_per_quantum,
+                    queries_per_quantum=self.queries_per_quantum)
+
+
+def _overall_input_ids(qgraph) -> set:
+    """Return the IDs of the datasets the graph reads but does not write."""
+    inputs = set()
+    outputs = {ref.id for ref in qgraph.globalInitOutputRefs()}
+    for task_def in qgraph.iterTaskGraph():
+        inputs.update(ref.id for ref in qgraph.initInputRefs(task_def) or ())
+        outputs.update(ref.id for ref in qgraph.initOutputRefs(task_def) or ())
+    for node in qgraph:
+        for refs in node.quantum.inputs.values():
+            inputs.update(ref.id for ref in refs)
+        for refs in node.quantum.outputs.values():
+            outputs.update(ref.id for ref in refs)
+    return inputs - outputs
+
+
+def _collect_dimension_records(source, qgraph) -> dict:
+    """Return the dimension records of every data ID in a quantum graph.
+
+    The records of the quanta, their inputs and their outputs (init-inputs
+    and init-outputs included) are taken from the graph if it holds them,
+    and otherwise looked up in the source repository.  The result maps
+    dimension element name to a mapping of record data ID to record.
+    """
+    data_ids = {ref.dataId for ref in qgraph.globalInitOutputRefs()}
+    for task_def in qgraph.iterTaskGraph():
+        for refs in (qgraph.initInputRefs(task_def), qgraph.initOutputRefs(task_def)):
+            data_ids.update(ref.dataId for ref in refs or ())
+    for node in qgraph:
+        data_ids.add(node.quantum.dataId)
+        for refs in (*node.quantum.inputs.values(), *node.quantum.outputs.values()):
+            data_ids.update(ref.dataId for ref in refs)
+    records = defaultdict(dict)
+    for data_id in data_ids:
+        if not data_id.hasRecords():
+            data_id = source.registry.expandDataId(data_id)
+        for element in data_id.dimensions.elements:
+            record = data_id.records[element]
+            if record is not None:
+                records[element][record.dataId] = record
+    return records
+
+
+def _register_collection(source, destination, name: str, registered: dict):
+    """Register a collection of the source repository, and the children of
+    chained collections, in the destination repository.
+    """
+    from lsst.daf.butler import CollectionType
+
+    if name in registered:
+        return
+    collection_type = source.registry.getCollectionType(name)
+    registered[name] = collection_type
+    if collection_type is CollectionType.RUN:
+        destination.registry.registerRun(name)
+    else:
+        destination.registry.registerCollection(name, collection_type)
+    if collection_type is CollectionType.CHAINED:
+        children = list(source.registry.getCollectionChain(name))
+        for child in children:
+            _register_collection(source, destination, child, registered)
+        destination.registry.setCollectionChain(name, children)
+
+
+def clone_inputs(source, qgraph, root: str, seed_config: str | None = None):
+    """Create a repository holding the overall inputs of a quantum graph.
+
+    Parameters
+    ----------
+    source : `lsst.daf.butler.Butler`
+        Butler of the repository the graph was built from.
+    qgraph : `lsst.pipe.base.QuantumGraph`
+        Quantum graph.
+    root : `str`
+        Root of the repository to create.
+    seed_config : `str`, optional
+        Butler seed config of the new repository.
+
+    Returns
+    -------
+    butler : `lsst.daf.butler.Butler`
+        Writeable butler of the new repository.
+    """
+    from lsst.daf.butler import Butler, CollectionType, Config
+
+    Butler.makeRepo(root, config=Config(seed_config) if seed_config else None)
+    destination = Butler.from_config(root, writeable=True)
+    registered = {}
+    for name in qgraph.metadata["input"]:
+        _register_collection(source, destination, name, registered)
+    # Outputs need records (visit, visit_detector_region, tract, patch...)
+    # that no input refers to, so the records of every data ID in the graph
+    # are copied, in dependency order; they include those of the inputs.
+    records = _collect_dimension_records(source, qgraph)
+    for element in destination.dimensions.sorted(records):
+        if element.has_own_table:
+            destination.registry.insertDimensionData(element, *records[element.name].values(),
+                                                     skip_existing=True)
+    refs = [source.registry.getDataset(dataset_id) for dataset_id in _overall_input_ids(qgraph)]
+    transferred = destination.transfer_from(source, refs, transfer="auto", register_dataset_types=True,
+                                            transfer_dimensions=False)
+    transferred = {ref.id for ref in transferred}
+    # Calibrations and other datasets are found through the associations of
+    # the input collections, not only their runs.
+    dataset_types = {ref.datasetType.name for ref in refs}
+    for name, collection_type in registered.items():
+        if collection_type not in (CollectionType.CALIBRATION, CollectionType.TAGGED):
+            continue
+        for dataset_type in dataset_types:
+            by_timespan = defaultdict(list)
+            for association in source.registry.queryDatasetAssociations(
+                    dataset_type, collections=name, collectionTypes={collection_type}, flattenChains=False):
+                if association.ref.id in transferred:
+                    by_timespan[association.timespan].append(association.ref)
+            for timespan, associated in by_timespan.items():
+                if collection_type is CollectionType.CALIBRATION:
+                    destination.registry.certify(name, associated, timespan)
+                else:
+                    destination.registry.associate(name, associated)
+    _LOG.info("Cloned %d input datasets and %d dimension records into %s.", len(transferred),
+              sum(len(element_records) for element_records in records.values()), root)
+    return destination
+
+
+def run_registry_benchmark(repo: str, qgraph_file: str, work_root: str, *, jobs: int = 1,
+                           server: LocalPostgres, seed_config: str | None = None,
+                           backends: Sequence[str] = BACKENDS, keep: bool = False) -> list[BackendResult]:
+    """Run a quantum graph against each registry backend.
+
+    Parameters
+    ----------
+    repo : `str`
+        Root of the ci_hsc_gen3 repository the graph was built from.
+    qgraph_file : `str`
+        Quantum graph of the main DRP run.
+    work_root : `str`
+        Directory of the benchmark repositories.
+    jobs : `int`, optional
+        Number of pipetask processes.
+    server : `~lsst.ci.hsc.gen3.postgres.LocalPostgres`
+        Running server for the PostgreSQL registry.
+    seed_config : `str`, optional
+        Butler seed config of the benchmark repositories; the PostgreSQL
+        repository adds its database to it.
+    backends : `~collections.abc.Sequence` [`str`], optional
+        Backends to run, from `BACKENDS`.
+    keep : `bool`, optional
+        Keep the benchmark repositories (and database) after the runs
+        instead of removing them.
+
+    Returns
+    -------
+    results : `list` [`BackendResult`]
+        One result per backend.
+    """
+    from lsst.daf.butler import Butler
+    from lsst.pipe.base import QuantumGraph
+
+    source = Butler.from_config(repo, writeable=False)
+    qgraph = QuantumGraph.loadUri(qgraph_file)
+    phase = dataclasses.replace(make_phases(repo)[0], qgraph_file=qgraph_file)
+    results = []
+    for backend in backends:
+        root = os.path.join(work_root, backend)
+        shutil.rmtree(root, ignore_errors=True)
+        seed = seed_config
+        if backend == "postgresql":
+            server.drop_database(DATABASE)
+            server.create_database(DATABASE)
+            seed = os.path.join(work_root, "postgresql-seed.yaml")
+            write_seed_config(seed, server.url(DATABASE), seed_config)
+        clone_inputs(source, qgraph, root, seed)
+        # Workers are forked so that their registry time is counted.
+        command = phase.run_command(root, jobs) + list(FORK_OPTIONS)
+        measurement = run_measured(f"registry benchmark {backend}", "benchmark", command,
+                                   count_queries=True)
+        results.append(BackendResult(backend=backend, quanta=len(qgraph), jobs=jobs,
+                                     returncode=measurement.returncode, wall_time=measurement.wall_time,
+                                     registry_time=measurement.registry_time,
+                                     registry_queries=measurement.registry_queries))
+        if not results[-1].succeeded:
+            _LOG.error("pipetask run failed on the %s registry with status %d; its per-quantum figures "
+                       "are not reported.", backend, measurement.returncode)
+        if not keep:
+            shutil.rmtree(root, ignore_errors=True)
+            if backend == "postgresql":
+                server.drop_database(DATABASE)
+    return results
+
+
+def format_results(results: Iterable[BackendResult]) -> str:
+    """Format the results of all backends as a table."""
+    def optional(value, width, spec, unit=""):
+        return f"{'-':>{width}}" if value is None else f"{value:{width - len(unit)}{spec}}{unit}"
+
+    lines = [f"{'backend':<12} {'quanta':>6} {'jobs':>4} {'status':>6} {'wall':>10} {'registry':>10} "
+             f"{'registry/quantum':>16} {'queries/quantum':>15}"]
+    for result in results:
+        per_quantum = result.registry_time_per_quantum
+        lines.append(f"{result.backend:<12} {result.quanta:>6} {result.jobs:>4} {result.returncode:>6} "
+                     f"{result.wall_time:9.1f}s {optional(result.registry_time, 10, '.1f', 's')} "
+                     f"{optional(None if per_quantum is None else per_quantum*1000, 16, '.1f', 'ms')} "
+                     f"{optional(result.queries_per_quantum, 15, '.1f')}")
+    return "\n".join(lines)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``runRegistryBenchmark.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the ci_hsc_gen3 data repository.")
+    parser.add_argument("--qgraph", default="ci_hsc.qg", help="Quantum graph to run; default is ci_hsc.qg.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of pipetask processes.")
+    parser.add_argument("--postgres-root", default=None,
+                        help=("Directory of the PostgreSQL cluster, started if it is not running; "
+                              "default is .postgres in the repository."))
+    parser.add_argument("--seed-config", default=None,
+                        help="Butler seed config of the benchmark repositories.")
+    parser.add_argument("--work-root", default=None,
+                        help="Directory of the benchmark repositories; default is registry_benchmark in the "
+                             "repository.")
+    parser.add_argument("--backend", dest="backends", choices=BACKENDS, action="append", default=None,
+                        help="Backend to run; may be given more than once.  Default is all backends.")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark repositories.")
+    parser.add_argument("--output", default=None, help="Write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = LocalPostgres(args.postgres_root or os.path.join(args.repo, ".postgres"))
+    started = server.start([])
+    try:
+        results = run_registry_benchmark(
+            args.repo, args.qgraph, args.work_root or os.path.join(args.repo, "registry_benchmark"),
+            jobs=args.jobs, server=server, seed_config=args.seed_config,
+            backends=args.backends or BACKENDS, keep=args.keep,
+        )
+    finally:
+        if started:
+            server.stop()
+    print(format_results(results))
+    if args.output:
+        with open(args.output, "w") as stream:
+            json.dump([result.to_dict() for result in results], stream, indent=2)
+    if any(result.returncode != 0 for result in results):
+        sys.exit(1)
@@ -0,0 +1,289 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Save and restore snapshots of the ingested data repository.
+
+A snapshot is a copy of the repository (registry and datastore) as left by
+the ``ingest`` SCons alias, stored under a key that hashes the inputs of
+the ingest: the contents of the configuration and manifest files, the
+ingest code, the versions of the set-up packages that write the
+repository, and the paths, sizes and modification times of the files in
+``testdata_ci_hsc``.  A clean build whose key is in the cache restores the
+snapshot instead of rebuilding the repository.
+
+Files are cloned with reflinks where the file system supports them.
+Otherwise, files in the datastore, which are never modified after they are
+written, are hard-linked, while the files at the top of the repository
+(the registry database and butler configuration), which are updated in
+place, are copied.
+"""
+
+from __future__ import annotations
+
+__all__ = ("RepositorySnapshotCache", "clone_tree", "main", "make_snapshot_key")
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections.abc import Iterable
+
+from .transfer import FileTransfer, TransferStats
+
+_LOG = logging.getLogger(__name__)
+
+INGEST_PACKAGES = ("daf_butler", "obs_base", "obs_subaru", "obs_subaru_data", "pipe_tasks", "skymap")
+"""Packages whose versions determine the contents of the ingested
+repository.
+"""
+
+EXCLUDED_FILES = ("DRP-ci_hsc+injection.yaml",)
+"""Files at the top of the repository that are not part of a snapshot.
+
+The source injection pipeline is written from the DRP pipeline definition,
+which changes far more often than the ingest inputs, so it is regenerated
+after every restore instead.
+"""
+
+_CHUNK_SIZE = 1 << 20
+
+
+def _hash_path(digest, path: str):
+    """Add the name and contents of a file, or of every file in a
+    directory, to a digest.
+    """
+    if os.path.isdir(path):
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for name in sorted(filenames):
+                _hash_path(digest, os.path.join(dirpath, name))
+        return
+    digest.update(f"{path}\n".encode())
+    with open(path, "rb") as stream:
+        while chunk := stream.read(_CHUNK_SIZE):
+            digest.update(chunk)
+
+
+def _fingerprint_tree(digest, root: str):
+    """Add the relative paths, sizes and modification times of the files
+    in a directory to a digest.
+    """
+    digest.update(f"{os.path.abspath(root)}\n".encode())
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            digest.update(f"{os.path.relpath(path, root)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+
+
+def make_snapshot_key(testdata_root: str, inputs: Iterable[str], options: Iterable[str] = (),
+                      packages: Iterable[str] = INGEST_PACKAGES) -> str:
+    """Return the cache key of the repository built from a set of inputs.
+
+    Parameters
+    ----------
+    testdata_root : `str`
+        Root of the ``testdata_ci_hsc`` package.  Its files are identified
+        by path, size and modification time rather than read, since they
+        amount to several gigabytes.
+    inputs : `~collections.abc.Iterable` [`str`]
+        Configuration files, manifests and code used by the ingest, or
+        directories of them; their contents are hashed.
+    options : `~collections.abc.Iterable` [`str`], optional
+        Other options of the ingest, e.g. ``--override``.
+    packages : `~collections.abc.Iterable` [`str`], optional
+        Names of the packages whose set-up versions are hashed.
+
+    Returns
+    -------
+    key : `str`
+        Hex digest.
+    """
+    from lsst.utils.packages import getEnvironmentPackages
+
+    versions = getEnvironmentPackages(include_all=True)
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        "options": list(options),
+        "packages": {name: versions.get(name) for name in sorted(packages)},
+    }, sort_keys=True).encode())
+    for path in sorted(inputs):
+        _hash_path(digest, path)
+    _fingerprint_tree(digest, testdata_root)
+    return digest.hexdigest()
+
+
+def clone_tree(source: str, destination: str, exclude: Iterable[str] = ()) -> TransferStats:
+    """Clone a data repository.
+
+    Parameters
+    ----------
+    source : `str`
+        Root of the repository to clone.
+    destination : `str`
+        Directory to create.
+    exclude : `~collections.abc.Iterable` [`str`], optional
+        Names of files at the top of the repository to leave out.
+
+    Returns
+    -------
+    stats : `~lsst.ci.hsc.gen3.transfer.TransferStats`
+        Bytes transferred by each method.
+
+    Notes
+    -----
+    Symbolic links are recreated rather than followed.  Only files in
+    subdirectories of ``source`` (the datastore) may be hard-linked, so that
+    writes to the registry database of one copy do not affect the other.
+    """
+    exclude = set(exclude)
+    datastore = FileTransfer("auto")
+    top_level = FileTransfer("reflink")
+    for dirpath, dirnames, filenames in os.walk(source):
+        relative = os.path.relpath(dirpath, source)
+        target = os.path.normpath(os.path.join(destination, relative))
+        os.makedirs(target, exist_ok=relative != ".")
+        # os.walk does not descend into symbolic links to directories, but
+        # lists them with the directories.
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            if relative == "." and name in exclude:
+                continue
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            elif name in filenames:
+                (top_level if relative == "." else datastore).transfer(path, os.path.join(target, name))
+    stats = TransferStats()
+    stats += datastore.stats
+    stats += top_level.stats
+    return stats
+
+
+class RepositorySnapshotCache:
+    """A directory of repository snapshots, indexed by cache key.
+
+    Parameters
+    ----------
+    root : `str`
+        Directory holding the snapshots.
+    keep : `int`, optional
+        Number of most recently used snapshots kept when a new one is saved.
+    """
+
+    def __init__(self, root: str, keep: int = 2):
+        self.root = root
+        self.keep = keep
+
+    def path(self, key: str) -> str:
+        """Return the directory of the snapshot with the given key."""
+        return os.path.join(self.root, key)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.isdir(self.path(key))
+
+    def save(self, key: str, repo_root: str) -> TransferStats | None:
+        """Save a snapshot of a repository, unless one with the same key
+        exists.
+
+        Returns
+        -------
+        stats : `~lsst.ci.hsc.gen3.transfer.TransferStats` or `None`
+            Bytes transferred, or `None` if the snapshot already existed.
+        """
+        if key in self:
+            return None
+        os.makedirs(self.root, exist_ok=True)
+        # Build the snapshot under a temporary name so an interrupted save
+        # is never mistaken for a complete one.
+        temporary = self.path(f".{key}.{os.getpid()}")
+        try:
+            stats = clone_tree(repo_root, temporary, exclude=EXCLUDED_FILES)
+            os.rename(temporary, self.path(key))
+        except OSError:
+            shutil.rmtree(temporary, ignore_errors=True)
+            if key in self:
+                # Saved concurrently by another build.
+                return None
+            raise
+        _LOG.info("Saved snapshot %s of %s (%s).", key, repo_root, stats)
+        self.prune()
+        return stats
+
+    def restore(self, key: str, repo_root: str) -> TransferStats:
+        """Restore a snapshot to a repository root, which must not exist.
+
+        Returns
+        -------
+        stats : `~lsst.ci.hsc.gen3.transfer.TransferStats`
+            Bytes transferred.
+        """
+        if os.path.lexists(repo_root):
+            raise FileExistsError(f"Cannot restore snapshot {key}: {repo_root} already exists.")
+        snapshot = self.path(key)
+        try:
+            stats = clone_tree(snapshot, repo_root)
+        except BaseException:
+            shutil.rmtree(repo_root, ignore_errors=True)
+            raise
+        # Mark the snapshot as recently used for pruning.
+        os.utime(snapshot)
+        _LOG.info("Restored snapshot %s to %s (%s).", key, repo_root, stats)
+        return stats
+
+    def prune(self):
+        """Remove all but the ``keep`` most recently used snapshots."""
+        snapshots = [entry for entry in os.scandir(self.root) if entry.is_dir() and entry.name[0] != "."]
+        snapshots.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+        for entry in snapshots[self.keep:]:
+            _LOG.info("Removing snapshot %s.", entry.name)
+            shutil.rmtree(entry.path)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``snapshotRepository.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("action", choices=("save", "restore"),
+                        help="Save the repository to the cache or restore it from there.")
+    parser.add_argument("repo", help="Root of the data repository.")
+    parser.add_argument("--cache", required=True, help="Directory of the snapshot cache.")
+    parser.add_argument("--key", default=None,
+                        help="Cache key of the repository; computed from the options below if not given.")
+    parser.add_argument("--testdata-root", default=None,
+                        help="Root of the testdata_ci_hsc package, for computing the key.")
+    parser.add_argument("--input", dest="inputs", action="append", default=[],
+                        help="Configuration file, manifest or code used by the ingest; may be repeated.")
+    parser.add_argument("--option", dest="options", action="append", default=[],
+                        help="Other option of the ingest; may be repeated.")
+    parser.add_argument("--keep", type=int, default=2,
+                        help="Number of snapshots kept in the cache; default is 2.")
+    args = parser.parse_args(argv)
+    if args.key is None and args.testdata_root is None:
+        parser.error("Either --key or --testdata-root is required.")
+
+    logging.basicConfig(level=logging.INFO)
+    key = args.key or make_snapshot_key(args.testdata_root, args.inputs, options=args.options)
+    cache = RepositorySnapshotCache(args.cache, keep=args.keep)
+    if args.action == "save":
+        cache.save(key, args.repo)
+    else:
+        cache.restore(key, args.repo)
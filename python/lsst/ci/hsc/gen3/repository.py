@@ -0,0 +1,138 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Construction of the ci_hsc_gen3 input data repository in one process.
+
+This performs the same sequence of steps as the ``butler`` commands run by
+the ``ingest`` SCons alias (``create``, ``register-instrument``,
+``write-curated-calibrations``, ``register-skymap``, ``ingest-raws``,
+``define-visits`` and the external-data ingest), but calls the underlying
+Python APIs directly with a single `~lsst.daf.butler.Butler`, so the stack is
+imported once and the registry is opened once.
+"""
+
+from __future__ import annotations
+
+__all__ = ("build_repository", "main")
+
+import argparse
+import logging
+import os
+from collections.abc import Iterable
+
+from .ingest import IngestManifest, ingest_external
+from .raw_ingest import RAW_COLLECTION, ingest_raws
+from .transfer import TRANSFER_MODES
+
+_LOG = logging.getLogger(__name__)
+
+INSTRUMENT = "lsst.obs.subaru.HyperSuprimeCam"
+CALIBRATION_COLLECTION = "HSC/calib"
+
+
+def build_repository(repo_root: str, testdata_root: str, *, skymap_config: str, manifest: IngestManifest,
+                     seed_config: str | None = None, override: bool = False, num_workers: int = 1,
+                     transfer: str = "hardlink", raw_index_cache: str | None = None):
+    """Create and populate the input data repository.
+
+    Parameters
+    ----------
+    repo_root : `str`
+        Root of the data repository to create.
+    testdata_root : `str`
+        Root of the ``testdata_ci_hsc`` package.
+    skymap_config : `str`
+        Path to the skymap configuration file.
+    manifest : `IngestManifest`
+        Description of the external inputs to ingest.
+    seed_config : `str`, optional
+        Path to a butler seed configuration.
+    override : `bool`, optional
+        If `True`, allow the configuration root to be overridden by the
+        repository location (``butler create --override``).
+    num_workers : `int`, optional
+        Number of processes used for raw ingest and threads used for the
+        external-data ingest.
+    transfer : `str`, optional
+        How the input files are transferred into the repository; one of
+        `~lsst.ci.hsc.gen3.transfer.TRANSFER_MODES`.
+    raw_index_cache : `str`, optional
+        Directory of cached index files of translated raw metadata.
+    """
+    from lsst.daf.butler import Butler, Config
+    from lsst.obs.base import DefineVisitsConfig, DefineVisitsTask
+    from lsst.pipe.base import Instrument
+    from lsst.pipe.tasks.script.registerSkymap import MakeSkyMapConfig
+
+    _LOG.info("Creating repository at %s.", repo_root)
+    Butler.makeRepo(repo_root, config=Config(seed_config) if seed_config else None,
+                    forceConfigRoot=not override)
+    butler = Butler.from_config(repo_root, writeable=True)
+
+    _LOG.info("Registering instrument %s.", INSTRUMENT)
+    instrument = Instrument.from_string(INSTRUMENT, butler.registry)
+    instrument.register(butler.registry)
+
+    _LOG.info("Writing curated calibrations to %s.", CALIBRATION_COLLECTION)
+    instrument.writeCuratedCalibrations(butler, collection=CALIBRATION_COLLECTION, labels=())
+
+    config = MakeSkyMapConfig()
+    config.load(skymap_config)
+    _LOG.info("Registering skymap %s.", config.name)
+    config.skyMap.apply().register(config.name, butler)
+
+    ingest_raws(butler, repo_root, os.path.join(testdata_root, "raw"), index_cache=raw_index_cache,
+                transfer=transfer, num_workers=num_workers)
+
+    config = DefineVisitsConfig()
+    instrument.applyConfigOverrides(DefineVisitsTask._DefaultName, config)
+    _LOG.info("Defining visits.")
+    DefineVisitsTask(config=config, butler=butler).run(
+        butler.registry.queryDataIds(["exposure"], dataId={"instrument": instrument.getName()},
+                                     collections=RAW_COLLECTION, datasets="raw"),
+        collections=RAW_COLLECTION,
+    )
+
+    ingest_external(butler, manifest, repo_root, testdata_root, num_workers=num_workers, transfer=transfer)
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``buildDataRepository.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("repo", help="Path to the data repository to create.")
+    parser.add_argument("testdata_root", help="Root of the testdata_ci_hsc package.")
+    parser.add_argument("--skymap-config", required=True, help="Path to the skymap configuration.")
+    parser.add_argument("--manifest", required=True, help="Path to the external-data ingest manifest.")
+    parser.add_argument("--seed-config", default=None, help="Path to a butler seed configuration.")
+    parser.add_argument("--override", action="store_true",
+                        help="Allow the config root to be overridden by the repository location.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of processes used for raw ingest.")
+    parser.add_argument("--transfer", choices=TRANSFER_MODES, default="hardlink",
+                        help="How input files are transferred into the repository; default is hardlink.")
+    parser.add_argument("--raw-index-cache", default=None,
+                        help="Directory of cached index files of translated raw metadata.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    build_repository(args.repo, args.testdata_root, skymap_config=args.skymap_config,
+                     manifest=IngestManifest.from_file(args.manifest), seed_config=args.seed_config,
+                     override=args.override, num_workers=args.jobs, transfer=args.transfer,
+                     raw_index_cache=args.raw_index_cache)
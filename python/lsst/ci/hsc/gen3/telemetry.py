@@ -0,0 +1,425 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Measure the time and resources used by each step of the ci_hsc_gen3
+build.
+
+Commands are run in a child process and measured with ``wait4``, so the
+figures include any processes the command waited for (e.g. the workers of
+``pipetask run -j``).  When telemetry is enabled, Python commands are run
+under a bootstrap that also counts and times the SQL statements executed by
+the registry, in the main process and in any worker processes it forks with
+`multiprocessing`.  Workers started with the ``spawn`` or ``forkserver``
+methods are not counted, so ``pipetask run`` is given
+``--start-method fork`` (see `FORK_OPTIONS`) wherever query counts are
+reported.
+
+Measurements are appended, one JSON object per line, to the file named by
+the ``CI_HSC_GEN3_TELEMETRY`` environment variable, which `write_report`
+turns into a JSON and a CSV report at the end of the run.
+
+Steps can be nested: the SCons targets are measured by ``measure.py``, and
+the commands they run may measure their own steps (pipeline phases, test
+workers).  Each measurement records the ID of the measurement it is nested
+in, if any, as ``parent``, and since the figures of a step include those of
+the steps nested in it, totals are taken over the top-level measurements
+only.
+"""
+
+from __future__ import annotations
+
+__all__ = ("FORK_OPTIONS", "Measurement", "MeasuredProcess", "QueryCounter", "TELEMETRY_ENV",
+           "TELEMETRY_PARENT_ENV", "is_enabled", "main", "record", "run_measured", "write_report")
+
+import argparse
+import atexit
+import csv
+import dataclasses
+import json
+import multiprocessing.util
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Iterable, Sequence
+
+TELEMETRY_ENV = "CI_HSC_GEN3_TELEMETRY"
+"""Environment variable naming the file measurements are appended to."""
+
+TELEMETRY_PARENT_ENV = "CI_HSC_GEN3_TELEMETRY_PARENT"
+"""Environment variable holding the ID of the measurement a process runs
+in, set by `MeasuredProcess` for its command.
+"""
+
+FORK_OPTIONS = ("--start-method", "fork")
+"""Options of ``pipetask run`` that make its workers forked, so that their
+registry queries are counted.
+"""
+
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+"""Size in bytes of the unit of ``ru_maxrss``."""
+
+_BLOCK_SIZE = 512
+"""Size in bytes of the unit of ``ru_inblock`` and ``ru_oublock``."""
+
+_BOOTSTRAP = ("import sys; from lsst.ci.hsc.gen3.telemetry import _run_counting_queries; "
+              "_run_counting_queries(sys.argv[1], sys.argv[2:])")
+
+
+@dataclasses.dataclass(frozen=True)
+class Measurement:
+    """Resources used by one command."""
+
+    name: str
+    """Name of the step, e.g. the SCons target or pipeline phase."""
+
+    kind: str
+    """Kind of step: ``ingest``, ``qgraph``, ``run``, ``test`` etc."""
+
+    command: tuple[str, ...]
+    returncode: int
+    start: float
+    """Start time, in seconds since the epoch."""
+
+    wall_time: float
+    """Elapsed time in seconds."""
+
+    cpu_time: float
+    """User and system CPU time in seconds."""
+
+    max_rss: int
+    """Peak resident set size in bytes of the largest process."""
+
+    read_bytes: int
+    """Bytes read from storage (reads served by the page cache are not
+    counted).
+    """
+
+    write_bytes: int
+    """Bytes written to storage."""
+
+    registry_queries: int | None = None
+    """Number of SQL statements executed by the command's Python processes,
+    or `None` if the command is not a Python program.
+    """
+
+    registry_time: float | None = None
+    """Time in seconds spent executing those SQL statements, summed over
+    processes, or `None` if the command is not a Python program.
+    """
+
+    id: str | None = None
+    """Identifier of the measurement."""
+
+    parent: str | None = None
+    """Identifier of the measurement this one is nested in, or `None` for a
+    top-level step.  The figures of the parent include this one's.
+    """
+
+
+class QueryCounter:
+    """Count and time the SQL statements executed through SQLAlchemy while
+    active.
+
+    All engines in the process are counted, so this includes registry
+    queries from every butler.
+
+    Parameters
+    ----------
+    report_file : `str`, optional
+        File that the count and time are appended to, as a line of JSON,
+        when the process exits.  Worker processes forked by
+        `multiprocessing` start counting from zero and append their own
+        line when they exit.
+    """
+
+    def __init__(self, report_file: str | None = None):
+        self.count = 0
+        self.time = 0.0
+        self.report_file = report_file
+        self._lock = threading.Lock()
+
+    def _before_execute(self, conn, *args, **kwargs):
+        conn.info.setdefault("ci_hsc_gen3_query_start", []).append(time.perf_counter())
+
+    def _after_execute(self, conn, *args, **kwargs):
+        elapsed = time.perf_counter() - conn.info["ci_hsc_gen3_query_start"].pop()
+        with self._lock:
+            self.count += 1
+            self.time += elapsed
+
+    def write(self):
+        """Append the count and time to the report file."""
+        with open(self.report_file, "a") as stream:
+            stream.write(json.dumps({"queries": self.count, "time": self.time}) + "\n")
+
+    def _after_fork(self):
+        self.count = 0
+        self.time = 0.0
+        self._lock = threading.Lock()
+        # Workers end with os._exit, which skips atexit handlers but not
+        # multiprocessing finalizers.
+        multiprocessing.util.Finalize(self, self.write, exitpriority=0)
+
+    def __enter__(self) -> QueryCounter:
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.listen(Engine, "before_cursor_execute", self._before_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_execute)
+        if self.report_file is not None:
+            atexit.register(self.write)
+            multiprocessing.util.register_after_fork(self, QueryCounter._after_fork)
+        return self
+
+    def __exit__(self, *args):
+        from sqlalchemy import event
+        from sqlalchemy.engine import Engine
+
+        event.remove(Engine, "before_cursor_execute", self._before_execute)
+        event.remove(Engine, "after_cursor_execute", self._after_execute)
+        if self.report_file is not None:
+            atexit.unregister(self.write)
+
+
+def _run_counting_queries(count_file: str, argv: Sequence[str]):
+    """Run a Python script or module as ``__main__``, appending the number
+    of SQL statements it and its workers executed, and the time they took,
+    to ``count_file`` when the processes exit.
+
+    ``argv`` is the command line without the interpreter, i.e. either a
+    script and its arguments or ``-m``, a module name and its arguments.
+    """
+    try:
+        QueryCounter(count_file).__enter__()
+    except ImportError:
+        # Not a registry client; leave the count file empty.
+        pass
+    if argv[0] == "-m":
+        sys.argv = list(argv[1:])
+        runpy.run_module(argv[1], run_name="__main__", alter_sys=True)
+    else:
+        sys.argv = list(argv)
+        sys.path[0] = os.path.dirname(os.path.abspath(argv[0]))
+        runpy.run_path(argv[0], run_name="__main__")
+
+
+def _is_python_script(path: str) -> bool:
+    try:
+        with open(path, "rb") as stream:
+            first_line = stream.readline(256)
+    except OSError:
+        return False
+    return first_line.startswith(b"#!") and b"python" in first_line
+
+
+def _python_argv(command: Sequence[str]) -> list[str] | None:
+    """Return the command line of a Python command without its interpreter,
+    or `None` if it is not a Python command.
+    """
+    if os.path.basename(command[0]).startswith("python"):
+        # Only scripts and modules; other interpreter options are not
+        # understood by the bootstrap.
+        if len(command) > 1 and (command[1] == "-m" or not command[1].startswith("-")):
+            return list(command[1:])
+        return None
+    path = command[0] if os.path.isfile(command[0]) else shutil.which(command[0])
+    if path is not None and _is_python_script(path):
+        return [path, *command[1:]]
+    return None
+
+
+def is_enabled() -> bool:
+    """Return whether telemetry is enabled, i.e. ``CI_HSC_GEN3_TELEMETRY`` is
+    set.
+    """
+    return bool(os.environ.get(TELEMETRY_ENV))
+
+
+def record(measurement: Measurement, path: str | None = None):
+    """Append a measurement to the telemetry file.
+
+    Parameters
+    ----------
+    measurement : `Measurement`
+        Measurement to record.
+    path : `str`, optional
+        File to append to; defaults to the value of ``CI_HSC_GEN3_TELEMETRY``.
+        Nothing is recorded if neither is set.
+    """
+    path = path or os.environ.get(TELEMETRY_ENV)
+    if not path:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # A single short write to a file opened for appending, so measurements
+    # from concurrent processes are not interleaved.
+    with open(path, "a") as stream:
+        stream.write(json.dumps(dataclasses.asdict(measurement)) + "\n")
+
+
+class MeasuredProcess:
+    """Start a command in a child process whose resource usage is measured.
+
+    Parameters
+    ----------
+    name : `str`
+        Name of the step.
+    kind : `str`
+        Kind of step.
+    command : `~collections.abc.Sequence` [`str`]
+        Command to run.
+    count_queries : `bool`, optional
+        Whether to count the registry queries of Python commands; by
+        default, only if telemetry is enabled, since the bootstrap that
+        counts them imports SQLAlchemy into the command.
+    **kwargs
+        Passed to `subprocess.Popen`.
+    """
+
+    def __init__(self, name: str, kind: str, command: Sequence[str], *, count_queries: bool | None = None,
+                 **kwargs):
+        self.name = name
+        self.kind = kind
+        self.command = tuple(command)
+        self.id = uuid.uuid4().hex[:16]
+        self.parent = os.environ.get(TELEMETRY_PARENT_ENV) or None
+        kwargs["env"] = dict(kwargs.get("env") or os.environ, **{TELEMETRY_PARENT_ENV: self.id})
+        self._count_file = None
+        args = list(command)
+        if count_queries is None:
+            count_queries = is_enabled()
+        python_argv = _python_argv(command) if count_queries else None
+        if python_argv is not None:
+            fd, self._count_file = tempfile.mkstemp(prefix="ci_hsc_gen3-queries-")
+            os.close(fd)
+            args = [sys.executable, "-c", _BOOTSTRAP, self._count_file, *python_argv]
+        self._start = time.time()
+        self._start_counter = time.perf_counter()
+        self._process = subprocess.Popen(args, **kwargs)
+
+    def _read_query_counts(self) -> tuple[int | None, float | None]:
+        if self._count_file is None:
+            return None, None
+        try:
+            with open(self._count_file) as stream:
+                lines = [json.loads(line) for line in stream if line.strip()]
+        finally:
+            os.remove(self._count_file)
+        # The file is empty if SQLAlchemy is not available or the process
+        # was killed before it could be written.
+        if not lines:
+            return None, None
+        return sum(line["queries"] for line in lines), sum(line["time"] for line in lines)
+
+    def wait(self) -> Measurement:
+        """Wait for the command to finish and record its measurement.
+
+        Returns
+        -------
+        measurement : `Measurement`
+            Resources used by the command.
+        """
+        _, status, usage = os.wait4(self._process.pid, 0)
+        wall_time = time.perf_counter() - self._start_counter
+        self._process.returncode = os.waitstatus_to_exitcode(status)
+        registry_queries, registry_time = self._read_query_counts()
+        measurement = Measurement(
+            name=self.name,
+            kind=self.kind,
+            command=self.command,
+            returncode=self._process.returncode,
+            start=self._start,
+            wall_time=wall_time,
+            cpu_time=usage.ru_utime + usage.ru_stime,
+            max_rss=usage.ru_maxrss*_RSS_UNIT,
+            read_bytes=usage.ru_inblock*_BLOCK_SIZE,
+            write_bytes=usage.ru_oublock*_BLOCK_SIZE,
+            registry_queries=registry_queries,
+            registry_time=registry_time,
+            id=self.id,
+            parent=self.parent,
+        )
+        record(measurement)
+        return measurement
+
+
+def run_measured(name: str, kind: str, command: Sequence[str], **kwargs) -> Measurement:
+    """Run a command, measuring and recording its resource usage.
+
+    Parameters are as for `MeasuredProcess`.
+    """
+    return MeasuredProcess(name, kind, command, **kwargs).wait()
+
+
+def write_report(path: str) -> list[Measurement]:
+    """Write the measurements of a run as a JSON and a CSV report.
+
+    Parameters
+    ----------
+    path : `str`
+        File the measurements were appended to.  The reports are written
+        next to it, with ``.json`` and ``.csv`` extensions.  Nested
+        measurements are reported with the others; only the rows without a
+        ``parent`` add up to the resources used by the run.
+
+    Returns
+    -------
+    measurements : `list` [`Measurement`]
+        All measurements, in the order they finished.
+    """
+    measurements = []
+    with open(path) as stream:
+        for line in stream:
+            if line.strip():
+                fields = json.loads(line)
+                measurements.append(Measurement(**dict(fields, command=tuple(fields["command"]))))
+    base = os.path.splitext(path)[0]
+    rows = [dataclasses.asdict(measurement) for measurement in measurements]
+    with open(f"{base}.json", "w") as stream:
+        json.dump(rows, stream, indent=2)
+    with open(f"{base}.csv", "w", newline="") as stream:
+        writer = csv.DictWriter(stream, fieldnames=[field.name for field in dataclasses.fields(Measurement)])
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict(row, command=" ".join(row["command"])))
+    return measurements
+
+
+def main(argv: Iterable[str] | None = None):
+    """Command-line entry point for ``measure.py``."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--name", required=True, help="Name of the step.")
+    parser.add_argument("--kind", default="target", help="Kind of step; default is 'target'.")
+    parser.add_argument("--report", default=None,
+                        help=f"File to append the measurement to; defaults to ${TELEMETRY_ENV}.")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command to run, after '--'.")
+    args = parser.parse_args(argv)
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("No command given.")
+    if args.report:
+        os.environ[TELEMETRY_ENV] = args.report
+    returncode = run_measured(args.name, args.kind, command).returncode
+    sys.exit(returncode if returncode >= 0 else 128 - returncode)
@@ -0,0 +1,240 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Transfer of input files into the data repository.
+
+The test inputs are never modified once ingested, so they can be linked
+into the repository instead of copied.  `FileTransfer` implements the
+transfer modes, falling back to cheaper-to-support methods when a mode is
+not available (e.g. hard links between different file systems), and counts
+the bytes moved by each method.
+"""
+
+from __future__ import annotations
+
+__all__ = ("TRANSFER_MODES", "FileTransfer", "TransferStats", "butler_transfer_mode", "survey_tree")
+
+import dataclasses
+import errno
+import os
+import shutil
+import sys
+import threading
+
+TRANSFER_MODES = ("copy", "hardlink", "symlink", "reflink", "direct")
+"""Modes of transferring the test inputs into the repository.
+
+``direct`` leaves the files where they are and records their absolute
+paths in the datastore; it is implemented by the butler, not
+`FileTransfer`.
+"""
+
+_FALLBACKS = {
+    "auto": ("reflink", "hardlink", "copy"),
+    "copy": ("copy",),
+    "hardlink": ("hardlink", "reflink", "copy"),
+    "reflink": ("reflink", "copy"),
+    "symlink": ("symlink",),
+}
+
+# Errors meaning that a method is not supported between the source and
+# destination, rather than that the transfer failed.  Other errors, such as
+# permission errors, are raised.
+_UNSUPPORTED = {
+    "reflink": (errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS),
+    "hardlink": (errno.EXDEV,),
+}
+
+# Errors meaning that a method cannot be used for one file only, e.g. one
+# that has reached the maximum number of hard links.
+_UNSUPPORTED_FOR_FILE = {
+    "hardlink": (errno.EMLINK,),
+}
+
+_FICLONE = 0x40049409
+
+
+@dataclasses.dataclass
+class TransferStats:
+    """Numbers of bytes transferred, by method."""
+
+    copied: int = 0
+    reflinked: int = 0
+    hardlinked: int = 0
+    symlinked: int = 0
+    files: int = 0
+
+    @property
+    def linked(self) -> int:
+        """Bytes that were linked or reflinked rather than copied."""
+        return self.reflinked + self.hardlinked + self.symlinked
+
+    def __iadd__(self, other: TransferStats) -> TransferStats:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+        return self
+
+    def __str__(self) -> str:
+        return (f"{self.files} files, {self.copied/1024**2:.1f} MiB copied, "
+                f"{self.linked/1024**2:.1f} MiB linked ({self.reflinked/1024**2:.1f} MiB reflinked, "
+                f"{self.hardlinked/1024**2:.1f} MiB hard-linked, {self.symlinked/1024**2:.1f} MiB symlinked)")
+
+
+def butler_transfer_mode(mode: str, source: str, destination: str) -> str:
+    """Return the butler transfer mode used for a mode in `TRANSFER_MODES`
+    by the steps whose files are transferred by the butler itself (the raw
+    ingest).
+
+    Parameters
+    ----------
+    mode : `str`
+        One of `TRANSFER_MODES`.
+    source : `str`
+        Directory the files are transferred from.
+    destination : `str`
+        Directory the files are transferred to, which must exist.
+
+    Returns
+    -------
+    butler_mode : `str`
+        Transfer mode for the butler.  The butler cannot reflink, so
+        ``reflink`` copies.  ``hardlink`` makes hard links if the two
+        directories are on the same file system and copies otherwise; the
+        butler's own fallback (its ``link`` mode) would make symbolic links
+        into the source instead.
+    """
+    if mode == "hardlink":
+        return "hardlink" if os.stat(source).st_dev == os.stat(destination).st_dev else "copy"
+    return {"reflink": "copy"}.get(mode, mode)
+
+
+def survey_tree(root: str) -> TransferStats:
+    """Classify the files under a directory by how they were transferred.
+
+    Symbolic links count as symlinked (by the size of their target), files
+    with more than one link as hard-linked and all others as copied, since
+    reflinks cannot be told apart from copies.
+    """
+    stats = TransferStats()
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            stat = os.lstat(path)
+            stats.files += 1
+            if os.path.islink(path):
+                stats.symlinked += os.stat(path).st_size if os.path.exists(path) else 0
+            elif stat.st_nlink > 1:
+                stats.hardlinked += stat.st_size
+            else:
+                stats.copied += stat.st_size
+    return stats
+
+
+class FileTransfer:
+    """Transfer files with one mode, falling back to other methods where
+    the mode is not supported.
+
+    Parameters
+    ----------
+    mode : `str`
+        ``copy``; ``hardlink`` (falling back to ``reflink``, then ``copy``);
+        ``reflink`` (falling back to ``copy``); ``symlink``; or ``auto``,
+        the cheapest of ``reflink``, ``hardlink`` and ``copy``.
+
+    Notes
+    -----
+    A method that fails because it is not supported (a reflink the file
+    system cannot make, or a hard link across file systems) is not tried
+    again by the same instance; any other error is raised.  Instances may
+    be shared between threads.
+    """
+
+    def __init__(self, mode: str):
+        if mode not in _FALLBACKS:
+            raise ValueError(f"Unsupported transfer mode {mode!r}; expected one of {sorted(_FALLBACKS)}.")
+        self.mode = mode
+        self.stats = TransferStats()
+        self._methods = [method for method in _FALLBACKS[mode]
+                         if method != "reflink" or sys.platform.startswith("linux")]
+        self._lock = threading.Lock()
+
+    def transfer(self, source: str, destination: str) -> str:
+        """Transfer one file.
+
+        Parameters
+        ----------
+        source : `str`
+            File to transfer.
+        destination : `str`
+            Path to create; its directory must exist.
+
+        Returns
+        -------
+        method : `str`
+            Method used.
+        """
+        size = os.path.getsize(source)
+        methods = list(self._methods)
+        for method in methods:
+            try:
+                getattr(self, f"_{method}")(source, destination)
+            except OSError as err:
+                if method == methods[-1]:
+                    raise
+                if err.errno in _UNSUPPORTED.get(method, ()):
+                    with self._lock:
+                        if method in self._methods:
+                            self._methods.remove(method)
+                elif err.errno not in _UNSUPPORTED_FOR_FILE.get(method, ()):
+                    raise
+                continue
+            with self._lock:
+                self.stats.files += 1
+                setattr(self.stats, _STAT_FIELDS[method], getattr(self.stats, _STAT_FIELDS[method]) + size)
+            return method
+        raise RuntimeError(f"No transfer method left for {source}.")
+
+    @staticmethod
+    def _copy(source: str, destination: str):
+        shutil.copy2(source, destination)
+
+    @staticmethod
+    def _hardlink(source: str, destination: str):
+        os.link(source, destination)
+
+    @staticmethod
+    def _symlink(source: str, destination: str):
+        os.symlink(os.path.abspath(source), destination)
+
+    @staticmethod
+    def _reflink(source: str, destination: str):
+        import fcntl
+
+        try:
+            with open(source, "rb") as input, open(destination, "wb") as output:
+                fcntl.ioctl(output.fileno(), _FICLONE, input.fileno())
+        except OSError:
+            if os.path.exists(destination):
+                os.remove(destination)
+            raise
+        shutil.copystat(source, destination)
+
+
+_STAT_FIELDS = {"copy": "copied", "reflink": "reflinked", "hardlink": "hardlinked", "symlink": "symlinked"}
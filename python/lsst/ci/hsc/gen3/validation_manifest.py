@@ -0,0 +1,239 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Record of the datasets that passed the output checks, so that reruns
+of the tests only check datasets that are new or have changed.
+
+For each check, the manifest holds the ID, file size and modification time
+of every dataset that passed it.  A dataset is considered unchanged if its
+ID, size and modification time are the same.  If only the modification time
+differs (e.g. the file was copied), the dataset is checked again, and a
+checksum is recorded for it so later changes of the modification time alone
+can be recognized without rerunning the check.  Checksums are never
+computed for datasets that are unchanged or new, since the checks
+themselves often read only part of a file.  Checks are identified by a hash of
+their parameters and the source code of their check functions, so editing
+a check invalidates its results.
+
+Each check is tagged with the test session that last ran it.  When a
+process saves its results, checks last run in an earlier session are
+dropped, and the datasets of a check are replaced by those the check saw in
+this session, so the manifest does not accumulate the dataset IDs of past
+runs or the results of checks that no longer exist.  The workers of one
+``runTests.py`` run share a session through ``CI_HSC_GEN3_VALIDATION_SESSION``;
+otherwise each process is a session of its own.
+"""
+
+from __future__ import annotations
+
+__all__ = ("SESSION_ENV", "ValidationManifest", "make_check_key")
+
+import fcntl
+import hashlib
+import inspect
+import json
+import os
+import uuid
+from collections.abc import Callable, Iterable
+
+SESSION_ENV = "CI_HSC_GEN3_VALIDATION_SESSION"
+"""Environment variable holding the ID of the test session shared by the
+processes running the tests.
+"""
+
+_CHUNK_SIZE = 1 << 20
+
+
+def make_check_key(*parameters, checks: Iterable[Callable] = ()) -> str:
+    """Return a key identifying a check.
+
+    Parameters
+    ----------
+    *parameters
+        Values that determine the outcome of the check, e.g. the dataset
+        type and expected minimum number of rows; their ``repr`` is hashed.
+    checks : `~collections.abc.Iterable` [`~collections.abc.Callable`]
+        Check functions run on each dataset; their source code is hashed.
+
+    Returns
+    -------
+    key : `str`
+        Hex digest.
+
+    Notes
+    -----
+    Only the source of the check functions is hashed, not the values they
+    use from elsewhere: closure variables, default arguments, attributes of
+    a bound method's instance or module constants.  Anything of that kind
+    that affects the outcome of a check must be passed in ``parameters``,
+    or changing it will not invalidate the recorded results.
+    """
+    digest = hashlib.blake2b(repr(parameters).encode(), digest_size=16)
+    for check in checks:
+        try:
+            source = inspect.getsource(check)
+        except (OSError, TypeError):
+            source = getattr(check, "__qualname__", repr(check))
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def _checksum(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as stream:
+        while chunk := stream.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ValidationManifest:
+    """Results of the output checks from earlier test runs.
+
+    Parameters
+    ----------
+    path : `str`, optional
+        JSON file holding the manifest.  If `None`, nothing is recorded and
+        every dataset is checked.
+    session : `str`, optional
+        ID of the test session; a new one by default.
+    """
+
+    def __init__(self, path: str | None, session: str | None = None):
+        self.path = path
+        self.session = session or uuid.uuid4().hex
+        self._checks: dict[str, dict] = self._read() if path else {}
+        self._updates: dict[str, dict[str, dict]] = {}
+        self._files: dict[tuple[str, str], str] = {}
+        self._checksums: dict[tuple[str, str], str] = {}
+
+    def _read(self) -> dict[str, dict]:
+        """Return the recorded checks, each a dict holding the ``session``
+        that last ran it and the entries of the ``datasets`` that passed it,
+        keyed by dataset ID.
+        """
+        try:
+            with open(self.path) as stream:
+                content = json.load(stream)
+        except FileNotFoundError:
+            return {}
+        # Manifests written before checks were tagged with sessions are
+        # discarded.
+        return content.get("checks", {})
+
+    def pending(self, key: str, refs: Iterable, butler) -> list:
+        """Return the datasets that have to be checked.
+
+        Parameters
+        ----------
+        key : `str`
+            Key of the check, from `make_check_key`.
+        refs : `~collections.abc.Iterable` [`lsst.daf.butler.DatasetRef`]
+            Datasets the check applies to.
+        butler : `lsst.daf.butler.Butler`
+            Butler holding the datasets.
+
+        Returns
+        -------
+        refs : `list` [`lsst.daf.butler.DatasetRef`]
+            Datasets that are new, have changed since they last passed the
+            check, or are not single local files; in the order given.
+        """
+        refs = list(refs)
+        if self.path is None:
+            return refs
+        passed = self._checks.get(key, {}).get("datasets", {})
+        pending = []
+        for ref, uris in butler.getManyURIs(refs).items():
+            dataset_id = str(ref.id)
+            if uris.primaryURI is None or not uris.primaryURI.isLocal:
+                pending.append(ref)
+                continue
+            path = uris.primaryURI.ospath
+            self._files[key, dataset_id] = path
+            entry = passed.get(dataset_id)
+            if entry is None or not self._unchanged(key, dataset_id, entry, path):
+                pending.append(ref)
+            else:
+                # Keep the entry, which is dropped on saving otherwise.
+                self._updates.setdefault(key, {}).setdefault(dataset_id, entry)
+        order = {ref.id: n for n, ref in enumerate(refs)}
+        return sorted(pending, key=lambda ref: order[ref.id])
+
+    def _unchanged(self, key: str, dataset_id: str, entry: dict, path: str) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        # Same size with a new modification time: compare contents, if a
+        # checksum was recorded, or record one when the check passes.
+        checksum = _checksum(path)
+        self._checksums[key, dataset_id] = checksum
+        if entry.get("checksum") != checksum:
+            return False
+        # Remember the new time so the file is not read again.
+        self._updates.setdefault(key, {})[dataset_id] = dict(entry, mtime_ns=stat.st_mtime_ns)
+        return True
+
+    def record(self, key: str, ref):
+        """Record that a dataset passed a check.
+
+        Parameters
+        ----------
+        key : `str`
+            Key of the check.
+        ref : `lsst.daf.butler.DatasetRef`
+            Dataset returned by `pending` for the same check.
+        """
+        path = self._files.get((key, str(ref.id)))
+        if path is None:
+            return
+        stat = os.stat(path)
+        entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        # Only known if the file was compared with an earlier entry.
+        checksum = self._checksums.get((key, str(ref.id)))
+        if checksum is not None:
+            entry["checksum"] = checksum
+        self._updates.setdefault(key, {})[str(ref.id)] = entry
+
+    def save(self):
+        """Merge the results recorded by this process into the manifest
+        file, dropping the results of earlier sessions.
+
+        The file is locked while it is updated, so processes running tests
+        concurrently can share it.
+        """
+        if self.path is None or not self._updates:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            checks = {key: check for key, check in self._read().items() if check["session"] == self.session}
+            for key, updates in self._updates.items():
+                checks.setdefault(key, {"session": self.session, "datasets": {}})["datasets"].update(updates)
+            temporary = f"{self.path}.{os.getpid()}"
+            with open(temporary, "w") as stream:
+                json.dump({"checks": checks}, stream)
+            os.replace(temporary, self.path)
+        self._checks = checks
+        self._updates = {}
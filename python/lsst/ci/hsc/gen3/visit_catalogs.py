@@ -0,0 +1,88 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""Cache of the visit-level calibration catalogs checked against coadd
+inputs.
+"""
+
+from __future__ import annotations
+
+__all__ = ("VisitCatalogCache",)
+
+from collections import OrderedDict
+
+
+class VisitCatalogCache:
+    """Least-recently-used cache of visit-level ``ExposureCatalog`` datasets
+    (e.g. ``finalized_psf_ap_corr_catalog`` or ``jointcalSkyWcsCatalog``),
+    indexed by detector.
+
+    Parameters
+    ----------
+    butler : `lsst.daf.butler.Butler`
+        Butler to read from.
+    maxsize : `int`, optional
+        Maximum number of catalogs held.
+    """
+
+    def __init__(self, butler, maxsize: int = 32):
+        self.butler = butler
+        self.maxsize = maxsize
+        self._catalogs: OrderedDict[tuple, dict] = OrderedDict()
+
+    def get(self, dataset_type: str, visit: int, **data_id) -> dict:
+        """Return the records of a visit-level catalog, keyed by detector.
+
+        Parameters
+        ----------
+        dataset_type : `str`
+            Name of the dataset type.
+        visit : `int`
+            Visit ID.
+        **data_id
+            Other data ID values, e.g. ``tract``.
+
+        Returns
+        -------
+        records : `dict` [`int`, `lsst.afw.table.ExposureRecord`]
+            Catalog records keyed by detector ID.
+        """
+        key = (dataset_type, visit, tuple(sorted(data_id.items())))
+        if key in self._catalogs:
+            self._catalogs.move_to_end(key)
+            return self._catalogs[key]
+        catalog = self.butler.get(dataset_type, visit=visit, **data_id)
+        records = {record.getId(): record for record in catalog}
+        self._catalogs[key] = records
+        if len(self._catalogs) > self.maxsize:
+            self._catalogs.popitem(last=False)
+        return records
+
+    def find(self, dataset_type: str, visit: int, detector: int, **data_id):
+        """Return the record for one detector of a visit-level catalog.
+
+        Parameters are as for `get`, plus the ``detector`` ID.
+
+        Returns
+        -------
+        record : `lsst.afw.table.ExposureRecord` or `None`
+            The detector's record, or `None` if the catalog has none.
+        """
+        return self.get(dataset_type, visit, **data_id).get(detector)
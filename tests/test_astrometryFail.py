@@ -20,22 +20,20 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numpy as np
-import os
 import unittest
 
 import lsst.utils.tests
 
-from lsst.daf.butler import Butler, DataCoordinate
-from lsst.utils import getPackageDir
+from lsst.daf.butler import DataCoordinate
 from lsst.ci.hsc.gen3 import ASTROMETRY_FAILURE_DATA_IDS
+from lsst.ci.hsc.gen3.fixtures import get_butler
 
 
 class TestAstrometryFails(lsst.utils.tests.TestCase):
     """Tests the outputs of the forced astrometry failures.
     """
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"), writeable=False,
-                             collections=["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
+        self.butler = get_butler(["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
         # The dataId here represents one of the astrometry fit failures
         # imposed by setting astrometry.maxMeanDistanceArcsec: 0.02 in
         # the pipeline.
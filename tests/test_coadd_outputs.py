@@ -20,7 +20,6 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import numbers
-import os
 import unittest
 
 import lsst.afw.image
@@ -28,11 +27,40 @@ import lsst.geom as geom
 import lsst.meas.algorithms
 import numpy as np
 from lsst.ci.hsc.gen3 import DATA_IDS
-from lsst.daf.butler import Butler
-from lsst.utils import getPackageDir
+from lsst.ci.hsc.gen3.fixtures import MemoryLimitMixin, get_butler, get_visit_catalog_cache
 
 
-class TestCoaddOutputs(unittest.TestCase):
+def input_contains(record, x, y):
+    """Return whether positions lie on a coadd input, as
+    ``ExposureCatalog.subsetContaining`` with ``includeValidPolygon=True``
+    decides for a single position.
+
+    Parameters
+    ----------
+    record : `lsst.afw.table.ExposureRecord`
+        Coadd input record.
+    x, y : `numpy.ndarray`
+        Positions in the pixel coordinates of the input.
+
+    Returns
+    -------
+    contains : `numpy.ndarray` [`bool`]
+        Whether each position is on the input.
+    """
+    bbox = record.getBBox()
+    # Positions are rounded to the nearest pixel, as Point2I does.
+    xi = np.floor(x + 0.5)
+    yi = np.floor(y + 0.5)
+    contains = ((xi >= bbox.getMinX()) & (xi <= bbox.getMaxX())
+                & (yi >= bbox.getMinY()) & (yi <= bbox.getMaxY()))
+    polygon = record.getValidPolygon()
+    if polygon is not None:
+        for n in np.flatnonzero(contains):
+            contains[n] = polygon.contains(geom.Point2D(x[n], y[n]))
+    return contains
+
+
+class TestCoaddOutputs(MemoryLimitMixin, unittest.TestCase):
     """Check that coadd outputs are as expected.
 
     Many tests here are ported from
@@ -40,9 +68,12 @@ class TestCoaddOutputs(unittest.TestCase):
     fd7d5e23d3c71e5d440153bc4faae7de9d5918c5/tests/nopytest_test_coadds.py
     """
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"),
-                             instrument="HSC", skymap="discrete/ci_hsc",
-                             writeable=False, collections=["HSC/runs/ci_hsc"])
+        super().setUp()
+        self.butler = get_butler(["HSC/runs/ci_hsc"], instrument="HSC", skymap="discrete/ci_hsc")
+        # Visit-level calibration catalogs are read once and shared by the
+        # tests of all warp and coadd inputs.
+        self.visit_catalogs = get_visit_catalog_cache(["HSC/runs/ci_hsc"], instrument="HSC",
+                                                      skymap="discrete/ci_hsc")
         self._tract = 0
         self._patch = 69
         self._bands = ['r', 'i']
@@ -128,39 +159,86 @@ class TestCoaddOutputs(unittest.TestCase):
             self.assertEqual(coadd_forced_src.schema, coadd_forced_schema)
 
     def test_coadd_transmission_curves(self):
-        """Test that coadded TransmissionCurves agree with the inputs."""
+        """Test that coadded TransmissionCurves agree with the inputs.
+
+        The curves are compared at the position of every object; the
+        positions on the coadd and on each input are computed for all
+        objects at once.
+        """
         wavelengths = np.linspace(4000, 7000, 10)
-        n_object_test = 10
-        ctx = np.random.RandomState(12345)
 
         for band in self._bands:
-            n_tested = 0
-            exp = self.butler.get("deepCoadd_calexp", band=band, tract=self._tract, patch=self._patch)
-            cat = self.butler.get("objectTable", band=band, tract=self._tract, patch=self._patch)
-            transmission_curve = exp.getInfo().getTransmissionCurve()
-            coadd_inputs = exp.getInfo().getCoaddInputs().ccds
-            wcs = exp.getWcs()
+            # Only the components needed are read; the pixels are not.
+            data_id = dict(band=band, tract=self._tract, patch=self._patch)
+            cat = self.butler.get("objectTable", parameters={"columns": ["coord_ra", "coord_dec"]},
+                                  **data_id)
+            transmission_curve = self.butler.get("deepCoadd_calexp.transmissionCurve", **data_id)
+            coadd_inputs = self.butler.get("deepCoadd_calexp.coaddInputs", **data_id).ccds
+            wcs = self.butler.get("deepCoadd_calexp.wcs", **data_id)
 
-            to_check = ctx.choice(len(cat), size=n_object_test, replace=False)
-            for index in to_check:
-                coadd_coord = geom.SpherePoint(np.asarray(cat["coord_ra"][index])*geom.degrees,
-                                               np.asarray(cat["coord_dec"][index])*geom.degrees)
-                summed_throughput = np.zeros(wavelengths.shape, dtype=np.float64)
-                weight_sum = 0.0
-                for rec in coadd_inputs.subsetContaining(coadd_coord, includeValidPolygon=True):
-                    det_pos = rec.getWcs().skyToPixel(coadd_coord)
-                    det_trans = rec.getTransmissionCurve()
-                    weight = rec.get("weight")
-                    summed_throughput += det_trans.sampleAt(det_pos, wavelengths)*weight
-                    weight_sum += weight
-                if weight_sum == 0.0:
-                    continue
-                summed_throughput /= weight_sum
-                coadd_pos = wcs.skyToPixel(coadd_coord)
-                coadd_throughput = transmission_curve.sampleAt(coadd_pos, wavelengths)
-                np.testing.assert_array_almost_equal(coadd_throughput, summed_throughput)
-                n_tested += 1
-            self.assertGreater(n_tested, 5)
+            ra = np.asarray(cat["coord_ra"])
+            dec = np.asarray(cat["coord_dec"])
+            summed_throughput = np.zeros((len(ra), len(wavelengths)))
+            weight_sum = np.zeros(len(ra))
+            for rec in coadd_inputs:
+                det_x, det_y = rec.getWcs().skyToPixelArray(ra, dec, degrees=True)
+                weight = rec.get("weight")
+                det_trans = rec.getTransmissionCurve()
+                for n in np.flatnonzero(input_contains(rec, det_x, det_y)):
+                    summed_throughput[n] += det_trans.sampleAt(geom.Point2D(det_x[n], det_y[n]),
+                                                               wavelengths)*weight
+                    weight_sum[n] += weight
+            covered = np.flatnonzero(weight_sum > 0.0)
+            summed_throughput = summed_throughput[covered]/weight_sum[covered, np.newaxis]
+            x, y = wcs.skyToPixelArray(ra[covered], dec[covered], degrees=True)
+            coadd_throughput = np.array([transmission_curve.sampleAt(position, wavelengths)
+                                         for position in map(geom.Point2D, x, y)])
+            np.testing.assert_array_almost_equal(coadd_throughput, summed_throughput)
+            self.assertGreater(len(covered), 5)
+            del cat, coadd_inputs
+
+    def check_input_ccds(self, coadd_inputs):
+        """Check the input CCD records of a warp or coadd against the
+        visit-level calibrations.
+
+        Parameters
+        ----------
+        coadd_inputs : `lsst.afw.image.CoaddInputs`
+            Inputs of the warp or coadd.
+        """
+        for det_record in coadd_inputs.ccds:
+            visit = det_record["visit"]
+            detector = det_record["ccd"]
+            with self.subTest(visit=visit, detector=detector):
+                wcs_record = self.visit_catalogs.find("jointcalSkyWcsCatalog", visit, detector,
+                                                      tract=self._tract)
+                final_psf_record = self.visit_catalogs.find("finalized_psf_ap_corr_catalog", visit, detector)
+                # The visit summary records the bounding box of each
+                # detector's calexp, so the calexps themselves need not be
+                # read.
+                summary_record = self.visit_catalogs.find("visitSummary", visit, detector)
+                # The WCS attached to the warp or coadd has a FITS
+                # approximation attached to it while the one in the
+                # jointcal catalog does not, so we have to drop that FITS
+                # approximation for them to compare as equal.
+                self.assertEqual(det_record.getWcs().copyWithFitsApproximation(None), wcs_record.getWcs())
+                self.assertEqual(
+                    det_record.getPhotoCalib(),
+                    lsst.afw.image.PhotoCalib(1.0),
+                )
+                self.assertEqual(det_record.getBBox(), summary_record.getBBox())
+                self.assertIsNotNone(det_record.getTransmissionCurve())
+                center = det_record.getBBox().getCenter()
+                np.testing.assert_array_almost_equal(
+                    det_record.getPsf().computeKernelImage(center).array,
+                    final_psf_record.getPsf().computeKernelImage(center).array
+                )
+                input_map = det_record.getApCorrMap()
+                final_map = final_psf_record.getApCorrMap()
+                self.assertEqual(len(input_map), len(final_map))
+                for key in input_map.keys():
+                    self.assertEqual(input_map[key], final_map[key])
+                self.assertIsNotNone(coadd_inputs.visits.find(visit))
 
     def test_warp_inputs(self):
         """Test that the warps have the correct inputs."""
@@ -171,54 +249,17 @@ class TestCoaddOutputs(unittest.TestCase):
             # We only need to test one dataset
             dataset = list(datasets)[0]
 
-            warp = self.butler.get(dataset)
-            self.assertEqual(warp.wcs, tract_info.wcs)
-            coadd_inputs = warp.getInfo().getCoaddInputs()
+            # Only the components needed are read; the pixels are not.
+            warp_wcs = self.butler.get(dataset.makeComponentRef("wcs"))
+            self.assertEqual(warp_wcs, tract_info.wcs)
+            coadd_inputs = self.butler.get(dataset.makeComponentRef("coaddInputs"))
             self.assertEqual(len(coadd_inputs.visits), 1)
             visit_record = coadd_inputs.visits[0]
-            self.assertEqual(visit_record.getWcs(), warp.wcs)
-            self.assertTrue(visit_record.getBBox().contains(warp.getBBox()))
+            self.assertEqual(visit_record.getWcs(), warp_wcs)
+            warp_bbox = self.butler.get(dataset.makeComponentRef("bbox"))
+            self.assertTrue(visit_record.getBBox().contains(warp_bbox))
             self.assertGreater(len(coadd_inputs.ccds), 0)
-
-            wcs_cat = self.butler.get(
-                "jointcalSkyWcsCatalog",
-                visit=visit_record.getId(),
-                tract=self._tract
-            )
-            final_psf_cat = self.butler.get(
-                "finalized_psf_ap_corr_catalog",
-                visit=visit_record.getId()
-            )
-
-            # We only need to test one input ccd
-            det_record = coadd_inputs.ccds[0]
-            exp_bbox = self.butler.get(
-                "calexp.bbox",
-                visit=det_record["visit"],
-                detector=det_record["ccd"]
-            )
-            # The WCS attached to the warp has a FITS approximation attached to
-            # it while the one in wcs_cat does not, so we have to drop that
-            # FITS approximation for them to compare as equal.
-            self.assertEqual(det_record.getWcs().copyWithFitsApproximation(None),
-                             wcs_cat.find(det_record["ccd"]).getWcs())
-            self.assertEqual(
-                det_record.getPhotoCalib(),
-                lsst.afw.image.PhotoCalib(1.0),
-            )
-            self.assertEqual(det_record.getBBox(), exp_bbox)
-            self.assertIsNotNone(det_record.getTransmissionCurve())
-            center = det_record.getBBox().getCenter()
-            np.testing.assert_array_almost_equal(
-                det_record.getPsf().computeKernelImage(center).array,
-                final_psf_cat.find(det_record["ccd"]).getPsf().computeKernelImage(center).array
-            )
-            input_map = det_record.getApCorrMap()
-            final_map = final_psf_cat.find(det_record["ccd"]).getApCorrMap()
-            self.assertEqual(len(input_map), len(final_map))
-            for key in input_map.keys():
-                self.assertEqual(input_map[key], final_map[key])
-            self.assertIsNotNone(coadd_inputs.visits.find(det_record["visit"]))
+            self.check_input_ccds(coadd_inputs)
 
     def test_coadd_inputs(self):
         """Test that the coadds have the correct inputs."""
@@ -233,44 +274,7 @@ class TestCoaddOutputs(unittest.TestCase):
                 tract=self._tract,
                 patch=self._patch
             )
-            # We only need to test one input ccd
-            det_record = coadd_inputs.ccds[0]
-            wcs_cat = self.butler.get(
-                "jointcalSkyWcsCatalog",
-                visit=det_record["visit"],
-                tract=self._tract
-            )
-            final_psf_cat = self.butler.get(
-                "finalized_psf_ap_corr_catalog",
-                visit=det_record["visit"]
-            )
-            exp_bbox = self.butler.get(
-                "calexp.bbox",
-                visit=det_record["visit"],
-                detector=det_record["ccd"]
-            )
-            # The WCS attached to the coadd has a FITS approximation attached
-            # to it while the one in wcs_cat does not, so we have to drop that
-            # FITS approximation for them to compare as equal.
-            self.assertEqual(det_record.getWcs().copyWithFitsApproximation(None),
-                             wcs_cat.find(det_record["ccd"]).getWcs())
-            self.assertEqual(
-                det_record.getPhotoCalib(),
-                lsst.afw.image.PhotoCalib(1.0),
-            )
-            self.assertEqual(det_record.getBBox(), exp_bbox)
-            self.assertIsNotNone(det_record.getTransmissionCurve())
-            center = det_record.getBBox().getCenter()
-            np.testing.assert_array_almost_equal(
-                det_record.getPsf().computeKernelImage(center).array,
-                final_psf_cat.find(det_record["ccd"]).getPsf().computeKernelImage(center).array
-            )
-            input_map = det_record.getApCorrMap()
-            final_map = final_psf_cat.find(det_record["ccd"]).getApCorrMap()
-            self.assertEqual(len(input_map), len(final_map))
-            for key in input_map.keys():
-                self.assertEqual(input_map[key], final_map[key])
-            self.assertIsNotNone(coadd_inputs.visits.find(det_record["visit"]))
+            self.check_input_ccds(coadd_inputs)
 
     def test_psf_installation(self):
         """Test that the coadd psf is installed."""
@@ -309,16 +313,25 @@ class TestCoaddOutputs(unittest.TestCase):
     def test_coadd_psf(self):
         """Test that the stars on the coadd are well represented by
         the attached PSF.
+
+        All bright, unresolved stars are checked, each against the PSF
+        evaluated at its own position; the star stamps are sliced from one
+        read of the image array.
         """
-        n_object_test = 10
         n_good_test = 5
-        ctx = np.random.RandomState(12345)
 
         for band in self._bands:
             exp = self.butler.get("deepCoadd_calexp", band=band, tract=self._tract, patch=self._patch)
             coadd_psf = exp.getPsf()
             wcs = exp.wcs
-            cat = self.butler.get("objectTable", band=band, tract=self._tract, patch=self._patch)
+            cat = self.butler.get(
+                "objectTable",
+                band=band,
+                tract=self._tract,
+                patch=self._patch,
+                parameters={"columns": ["coord_ra", "coord_dec", "i_extendedness", "detect_isPrimary",
+                                        f"{band}_psfFlux", f"{band}_psfFluxErr"]},
+            )
 
             star_cat = cat[(cat["i_extendedness"] < 0.5)
                            & (cat["detect_isPrimary"])
@@ -326,30 +339,30 @@ class TestCoaddOutputs(unittest.TestCase):
                            & (cat[f"{band}_psfFlux"]/cat[f"{band}_psfFluxErr"] > 50.0)
                            & (cat[f"{band}_psfFlux"]/cat[f"{band}_psfFluxErr"] < 200.0)]
 
-            to_check = ctx.choice(len(star_cat), size=n_object_test, replace=False)
+            x, y = wcs.skyToPixelArray(np.asarray(star_cat["coord_ra"]), np.asarray(star_cat["coord_dec"]),
+                                       degrees=True)
+            image_array = exp.image.array
+            image_bbox = exp.getBBox()
             n_good = 0
-            for index in to_check:
-                skyPos = geom.SpherePoint(np.asarray(star_cat["coord_ra"])[index],
-                                          np.asarray(star_cat["coord_dec"])[index],
-                                          geom.degrees)
-                position = wcs.skyToPixel(skyPos)
+            for position in map(geom.Point2D, x, y):
                 psf_image = coadd_psf.computeImage(position)
-                psf_image_bbox = psf_image.getBBox()
-                star_image = lsst.afw.image.ImageF(
-                    exp.maskedImage.image,
-                    psf_image_bbox
-                ).convertD()
-                star_image /= star_image.array.sum()
-                psf_image /= psf_image.array.sum()
-                residuals = lsst.afw.image.ImageD(star_image, True)
-                residuals -= psf_image
+                psf_bbox = psf_image.getBBox()
+                if not image_bbox.contains(psf_bbox):
+                    continue
+                star_array = image_array[psf_bbox.getMinY() - image_bbox.getMinY():
+                                         psf_bbox.getMaxY() - image_bbox.getMinY() + 1,
+                                         psf_bbox.getMinX() - image_bbox.getMinX():
+                                         psf_bbox.getMaxX() - image_bbox.getMinX() + 1].astype(np.float64)
+                residuals = star_array/star_array.sum() - psf_image.array/psf_image.array.sum()
                 # This is just a quick check that the coadd psf model works
                 # reasonably well for the stars. It is not meant as a detailed
                 # test of the psf modeling capability.
-                if np.max(np.abs(residuals.array)) < 0.01:
+                if np.max(np.abs(residuals)) < 0.01:
                     n_good += 1
 
             self.assertGreater(n_good, n_good_test)
+            # Release this band's coadd before the next one is read.
+            del exp, coadd_psf, cat, star_cat, image_array
 
 
 if __name__ == "__main__":
@@ -19,13 +19,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
 import unittest
 
 import lsst.utils.tests
-from lsst.daf.butler import Butler, DataCoordinate
+from lsst.ci.hsc.gen3.fixtures import get_butler
+from lsst.daf.butler import DataCoordinate
 from lsst.geom import Box2I, Point2I
-from lsst.utils import getPackageDir
 
 
 class TestFilterLabelFixups(lsst.utils.tests.TestCase):
@@ -47,8 +46,7 @@ class TestFilterLabelFixups(lsst.utils.tests.TestCase):
     """
 
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"), writeable=False,
-                             collections=["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
+        self.butler = get_butler(["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
         # We need to provide a physical_filter value to fully identify a flat,
         # but this still leaves the band as an implied value that this data ID
         # doesn't know.
@@ -23,19 +23,16 @@ import unittest
 import os
 import re
 
-from lsst.daf.butler import Butler
-from lsst.utils import getPackageDir
+from lsst.ci.hsc.gen3.fixtures import get_butler, get_repo_root
 from lsst.resources import ResourcePath
 
 
 class TestHipsOutputs(unittest.TestCase):
     """Check that HIPS outputs are as expected."""
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"),
-                             instrument="HSC", skymap="discrete/ci_hsc",
-                             writeable=False, collections=["HSC/runs/ci_hsc_hips"])
+        self.butler = get_butler(["HSC/runs/ci_hsc_hips"], instrument="HSC", skymap="discrete/ci_hsc")
         self._bands = ['r', 'i']
-        self.hips_uri_base = ResourcePath(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA", "hips"))
+        self.hips_uri_base = ResourcePath(os.path.join(get_repo_root(), "hips"))
 
     def test_hips_exist(self):
         """Test that the HIPS images exist and are readable."""
@@ -0,0 +1,52 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from lsst.ci.hsc.gen3.raw_ingest import make_command_args, make_parser
+
+
+class TestIngestRawsCommandLine(unittest.TestCase):
+    """Check that ingestRaws.py accepts the command lines the SConstruct
+    builds.
+    """
+
+    def test_with_index_cache(self):
+        argv = make_command_args("DATA", "testdata_ci_hsc/raw", raw_index_cache=".cache/raw_index",
+                                 transfer="copy", jobs=4)
+        args = make_parser().parse_args(argv)
+        self.assertEqual(args.repo, "DATA")
+        self.assertEqual(args.raw_root, "testdata_ci_hsc/raw")
+        self.assertEqual(args.raw_index_cache, ".cache/raw_index")
+        self.assertEqual(args.transfer, "copy")
+        self.assertEqual(args.jobs, 4)
+
+    def test_without_index_cache(self):
+        # "scons --raw-index-cache=" disables the cache.
+        argv = make_command_args("DATA", "testdata_ci_hsc/raw", raw_index_cache="")
+        args = make_parser().parse_args(argv)
+        self.assertIsNone(args.raw_index_cache)
+        self.assertEqual(args.transfer, "hardlink")
+        self.assertEqual(args.jobs, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
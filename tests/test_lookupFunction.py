@@ -1,12 +1,10 @@
-import os
 import unittest
 
-import lsst.daf.butler as dafButler
 import lsst.pipe.base as pipeBase
 import lsst.utils.tests
 
+from lsst.ci.hsc.gen3.fixtures import get_butler
 from lsst.pipe.base.all_dimensions_quantum_graph_builder import AllDimensionsQuantumGraphBuilder
-from lsst.utils import getPackageDir
 
 
 class PrerequisiteLookupFunctionTestError(Exception):
@@ -69,7 +67,7 @@ class PrerequisiteConnectionLookupFunctionTest(unittest.TestCase):
         """This tests that a lookup function defined on a prerequisite input
         is called when building a quantum graph.
         """
-        butler = dafButler.Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA", "butler.yaml"))
+        butler = get_butler()
 
         pipeline = pipeBase.Pipeline("Test LookupFunction Pipeline")
         pipeline.addTask(LookupTestPipelineTask, "test")
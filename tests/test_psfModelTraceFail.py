@@ -19,22 +19,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
 import unittest
 
 import lsst.utils.tests
 
 from lsst.ci.hsc.gen3 import PSF_MODEL_ROBUSTNESS_FAILURE_DATA_IDS
-from lsst.daf.butler import Butler, DataCoordinate
-from lsst.utils import getPackageDir
+from lsst.ci.hsc.gen3.fixtures import get_butler
+from lsst.daf.butler import DataCoordinate
 
 
 class TestPsfModelTraceRadiusFails(lsst.utils.tests.TestCase):
     """Test the deselection of detectors based on PSF model robustness check.
     """
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"), writeable=False,
-                             collections=["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
+        self.butler = get_butler(["HSC/calib/2013-06-17", "HSC/runs/ci_hsc"])
         self.skymap = "discrete/ci_hsc"
         self.tract = 0
         self.patch = 69
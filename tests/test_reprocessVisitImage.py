@@ -19,13 +19,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
 import unittest
 
 import lsst.utils.tests
 import numpy as np
-from lsst.daf.butler import Butler
-from lsst.utils import getPackageDir
+from lsst.ci.hsc.gen3.fixtures import get_butler
 
 
 class TestReprocessVisitImageOutputs(lsst.utils.tests.TestCase):
@@ -35,8 +33,7 @@ class TestReprocessVisitImageOutputs(lsst.utils.tests.TestCase):
     """
 
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"),
-                             writeable=False, collections=["HSC/runs/ci_hsc"])
+        self.butler = get_butler(["HSC/runs/ci_hsc"])
         self.dataId = {"instrument": "HSC", "detector": 100, "visit": 903334}
         self.exposure = self.butler.get("pvi", self.dataId)
         self.catalog = self.butler.get("sources_footprints_detector", self.dataId)
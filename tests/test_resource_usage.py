@@ -0,0 +1,66 @@
+# This file is part of ci_hsc_gen3.
+#
+# Developed for the LSST Data Management System.
+# This product includes software developed by the LSST Project
+# (https://www.lsst.org).
+# See the COPYRIGHT file at the top-level directory of this distribution
+# for details of code ownership.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from lsst.ci.hsc.gen3.benchmark import load_budgets, read_resource_usage
+from lsst.ci.hsc.gen3.fixtures import get_butler
+from lsst.pipe.base import QuantumGraph
+
+
+class TestResourceUsage(unittest.TestCase):
+    """Check the resource usage gathered from the ci_hsc_gen3 DRP run."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.butler = get_butler(["HSC/runs/ci_hsc_resource_usage"])
+        cls.usage = read_resource_usage(cls.butler, ["HSC/runs/ci_hsc_resource_usage"])
+        cls.budgets = load_budgets()
+
+    def test_all_tasks_gathered(self):
+        """Test that there is resource usage for every task in the DRP
+        quantum graph.
+        """
+        qg = QuantumGraph.loadUri("ci_hsc.qg", nodes=[])
+        for task_label in qg.pipeline_graph.tasks:
+            with self.subTest(task_label=task_label):
+                self.assertIn(task_label, self.usage)
+                self.assertGreater(self.usage[task_label].quanta, 0)
+
+    def test_budgets(self):
+        """Test that no quantum exceeds its task's memory and CPU time
+        budgets.
+        """
+        for task_label, usage in self.usage.items():
+            budget = self.budgets[task_label]
+            with self.subTest(task_label=task_label):
+                self.assertLessEqual(
+                    usage.peak_memory, budget.memory,
+                    msg=f"Peak memory of {task_label} is {usage.peak_memory/1024**2:.0f} MiB"
+                )
+                self.assertLessEqual(
+                    usage.max_run_time, budget.run_time,
+                    msg=f"Longest runtime of {task_label} is {usage.max_run_time:.0f} s"
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -24,7 +24,7 @@ import unittest
 
 from felis import Schema
 
-from lsst.daf.butler import Butler
+from lsst.ci.hsc.gen3.fixtures import get_butler
 from lsst.utils import getPackageDir
 import lsst.utils.tests
 
@@ -33,11 +33,7 @@ class TestSchemaMatch(lsst.utils.tests.TestCase):
     """Check the schema of the parquet outputs match the DDL in sdm_schemas"""
 
     def setUp(self):
-        self.butler = Butler(
-            os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"),
-            writeable=False,
-            collections=["HSC/runs/ci_hsc"],
-        )
+        self.butler = get_butler(["HSC/runs/ci_hsc"])
         schemaFile = os.path.join(getPackageDir("sdm_schemas"), "yml", "hsc.yaml")
         self.schema = Schema.from_uri(schemaFile, context={"id_generation": True})
 
@@ -18,46 +18,55 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
-import os
 import unittest
 
+import numpy as np
+
 from lsst.ci.hsc.gen3 import (
     DATA_IDS,
     ASTROMETRY_FAILURE_DATA_IDS,
     INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS,
 )
-from lsst.daf.butler import Butler, DataCoordinate
+from lsst.ci.hsc.gen3.fixtures import (
+    MemoryLimitMixin,
+    get_butler,
+    get_dataset_index,
+    get_validation_manifest,
+    make_loader,
+)
+from lsst.ci.hsc.gen3.validation_manifest import make_check_key
+from lsst.daf.butler import DataCoordinate
 from lsst.pipe.base import QuantumGraph
 import lsst.pipe.base.quantum_provenance_graph as qpg
-from lsst.utils import getPackageDir
-
 
-def to_set_of_tuples(list_of_dicts):
-    """Convert a list of dictionary {visit, detector} data IDs into a set of
-    (visit, detector) tuples
-    """
-    return {(d["visit"], d["detector"]) for d in list_of_dicts}
 
-
-class TestValidateOutputs(unittest.TestCase):
+class TestValidateOutputs(MemoryLimitMixin, unittest.TestCase):
     """Check that ci_hsc_gen3 outputs are as expected."""
 
     def setUp(self):
-        self.butler = Butler(os.path.join(getPackageDir("ci_hsc_gen3"), "DATA"),
-                             instrument="HSC", skymap="discrete/ci_hsc",
-                             writeable=False, collections=["HSC/runs/ci_hsc"])
-
-        self._raws = to_set_of_tuples(DATA_IDS)
-        self._forced_astrom_failures = to_set_of_tuples(ASTROMETRY_FAILURE_DATA_IDS)
+        super().setUp()
+        # These are shared by all tests in the process, so there is no
+        # per-class set-up and bin/runTests.py may spread the tests of this
+        # class over its workers.
+        self.butler = get_butler(["HSC/runs/ci_hsc"], instrument="HSC", skymap="discrete/ci_hsc")
+        # All existence and count checks read from this index, which is
+        # built with one registry query and shared with other test modules
+        # in the same process.
+        self.index = get_dataset_index(["HSC/runs/ci_hsc"])
+        # Datasets that passed the per-dataset checks in an earlier run and
+        # have not changed since are not checked again.
+        self.manifest = get_validation_manifest()
+        self.loader = make_loader(self.butler)
+
+        self._raws = DATA_IDS
+        self._forced_astrom_failures = ASTROMETRY_FAILURE_DATA_IDS
         # Four detectors have template coverage < 0.2 soft limit, but two
         # succeed anyway.  These are just the failures.
-        self._insufficient_template_coverage_failures = to_set_of_tuples(
-            INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS
-        )
-        self._num_visits = len({data_id["visit"] for data_id in DATA_IDS})
+        self._insufficient_template_coverage_failures = INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS
+        self._num_visits = len(DATA_IDS.visits)
         self._num_tracts = 1
         self._num_patches = 1
-        self._num_bands = len({data_id["physical_filter"] for data_id in DATA_IDS})
+        self._num_bands = len(DATA_IDS.physical_filters)
         self._min_sources = 100
         # Check that DIA catalogs have nonzero length
         self._min_diasources = 0
@@ -79,7 +88,8 @@ class TestValidateOutputs(unittest.TestCase):
             self.check_datasets([f"{name}_metadata"], n_metadata)
             self.check_datasets([f"{name}_log"], n_log)
 
-    def check_datasets(self, dataset_types, n_expected, max_expected=None, additional_checks=[], **kwargs):
+    def check_datasets(self, dataset_types, n_expected, max_expected=None, additional_checks=[],
+                       component_checks=None, parameters=None, **kwargs):
         """Check dataset existence, and run additional checks.
 
         Parameters
@@ -94,12 +104,18 @@ class TestValidateOutputs(unittest.TestCase):
             Maximum number of each dataset_type expected in repo.
         additional_checks : `list` [`func`], optional
             List of additional check functions to run on each dataset.
+        component_checks : `dict` [`str`, `list` [`func`]], optional
+            Check functions to run on components of each dataset, keyed by
+            component; only those components are read.
+        parameters : `dict`, optional
+            Storage class parameters used to read the datasets for
+            ``additional_checks``, e.g. ``bbox`` to read a subimage.
         **kwargs : `dict`, optional
             Additional keywords to send to ``additional_checks``.
         """
         for dataset_type in dataset_types:
 
-            datasets = set(self.butler.registry.queryDatasets(dataset_type))
+            datasets = self.index.refs(dataset_type)
 
             if max_expected is not None:
                 self.assertGreaterEqual(len(datasets), n_expected, msg=f"Number of {dataset_type}")
@@ -107,20 +123,33 @@ class TestValidateOutputs(unittest.TestCase):
             else:
                 self.assertEqual(len(datasets), n_expected, msg=f"Number of {dataset_type}")
 
-            stored = self.butler.stored_many(datasets)
             for dataset in datasets:
-                self.assertTrue(stored[dataset], msg=f"File exists for {dataset}")
-
-                if additional_checks:
-                    data = self.butler.get(dataset)
-                    for additional_check in additional_checks:
+                self.assertTrue(self.index.stored(dataset), msg=f"File exists for {dataset}")
+
+            checks = {None: additional_checks} if additional_checks else {}
+            checks.update(component_checks or {})
+            for component, component_additional_checks in checks.items():
+                key = make_check_key(dataset_type, component, parameters, kwargs,
+                                     checks=component_additional_checks)
+                pending = self.manifest.pending(key, datasets, self.butler)
+                if component is not None:
+                    pending = [dataset.makeComponentRef(component) for dataset in pending]
+                for dataset, data in self.loader.iter_get(pending, parameters=parameters):
+                    for additional_check in component_additional_checks:
                         additional_check(data, **kwargs)
+                    # Release each dataset before the next one is read.
+                    del data
+                    self.manifest.record(key, dataset)
 
     def check_sources(self, source_dataset_types, n_expected, min_src,
-                      max_expected=None, additional_checks=[], **kwargs):
+                      max_expected=None, additional_checks=[], columns=None, **kwargs):
         """Check that the source catalogs have enough sources and
         run additional checks.
 
+        Catalogs are read concurrently.  If there are no additional checks
+        only the number of rows is read, from the Parquet or FITS metadata
+        where possible.
+
         Parameters
         ----------
         dataset_types : `list` [`str`]
@@ -135,12 +164,15 @@ class TestValidateOutputs(unittest.TestCase):
             Minimum number of sources for each dataset.
         additional_checks : `list` [`func`], optional
             List of additional check functions to run on each dataset.
+        columns : `list` [`str`], optional
+            Columns needed by ``additional_checks``; if given, only these
+            are read from catalogs whose storage class supports it.
         **kwargs : `dict`, optional
             Additional keywords to send to ``additional_checks``.
         """
         for source_dataset_type in source_dataset_types:
 
-            datasets = set(self.butler.registry.queryDatasets(source_dataset_type))
+            datasets = self.index.refs(source_dataset_type)
 
             if max_expected is None:
                 self.assertEqual(len(datasets), n_expected, msg=f"Number of {source_dataset_type}")
@@ -148,12 +180,22 @@ class TestValidateOutputs(unittest.TestCase):
                 self.assertGreaterEqual(len(datasets), n_expected, msg=f"Number of {source_dataset_type}")
                 self.assertLessEqual(len(datasets), max_expected, msg=f"Number of {source_dataset_type}")
 
-            for dataset in datasets:
-                catalog = self.butler.get(dataset)
+            key = make_check_key(source_dataset_type, min_src, columns, kwargs, checks=additional_checks)
+            datasets = self.manifest.pending(key, datasets, self.butler)
+
+            if not additional_checks:
+                for dataset, n_sources in self.loader.iter_row_counts(datasets):
+                    self.assertGreater(n_sources, min_src, msg=f"Number of sources in {dataset}")
+                    self.manifest.record(key, dataset)
+                continue
+
+            for dataset, catalog in self.loader.iter_get(datasets, columns=columns):
                 self.assertGreater(len(catalog), min_src, msg=f"Number of sources in {dataset}")
 
                 for additional_check in additional_checks:
                     additional_check(catalog, **kwargs)
+                del catalog
+                self.manifest.record(key, dataset)
 
     def test_raw(self):
         """Test existence of raw exposures."""
@@ -229,24 +271,21 @@ class TestValidateOutputs(unittest.TestCase):
     def test_assemble_coadd(self):
         """Test existence of coadds."""
 
-        def check_bright_star_mask(coadd):
-            mask = coadd.getMaskedImage().getMask()
+        def check_bright_star_mask(mask):
             mask_val = mask.getPlaneBitMask("BRIGHT_OBJECT")
-            num_bright = (mask.getArray() & mask_val).sum()
+            num_bright = np.count_nonzero(mask.array & mask_val)
             self.assertGreater(num_bright, 0, msg="Some pixels are masked as BRIGHT_OBJECT")
 
-        def check_transmission_curves(coadd):
-            self.assertTrue(coadd.getInfo().getTransmissionCurve() is not None,
-                            msg="TransmissionCurves are attached to coadds")
+        def check_transmission_curves(transmission_curve):
+            self.assertIsNotNone(transmission_curve, msg="TransmissionCurves are attached to coadds")
 
         n_output = self._num_patches*self._num_bands
         self.check_pipetasks(["assembleCoadd"], n_output, n_output)
-        self.check_datasets(
-            ["deepCoadd"],
-            n_output,
-            additional_checks=[check_bright_star_mask,
-                               check_transmission_curves]
-        )
+        # Only the components that are checked are read, not the image,
+        # variance and PSF.
+        self.check_datasets(["deepCoadd"], n_output,
+                            component_checks={"mask": [check_bright_star_mask],
+                                              "transmissionCurve": [check_transmission_curves]})
 
     def test_healsparse_property_maps(self):
         """Test existence of healsparse property maps."""
@@ -597,7 +636,7 @@ class TestValidateOutputs(unittest.TestCase):
         # themselves that have the same {visit, detector}; note that this does
         # not include visit-level aggregates that are downstream (or any other
         # kind of downstream aggregate).
-        expected_keys_with_caveats: set[qpg.QuantumKey | qpg.DatasetKey] = set()
+        failures: dict[qpg.QuantumKey, tuple[int, int]] = {}
         for task_label, exc_type, dict_data_ids in [
             ("calibrateImage", "lsst.meas.astrom.exceptions.BadAstrometryFit", ASTROMETRY_FAILURE_DATA_IDS),
             ("subtractImages", None, INSUFFICIENT_TEMPLATE_COVERAGE_FAILURE_DATA_IDS),
@@ -611,33 +650,50 @@ class TestValidateOutputs(unittest.TestCase):
                     self.assertEqual(quantum_run.exception.type_name, exc_type)
                 else:
                     self.assertIsNone(quantum_run.exception)
-                expected_keys_with_caveats.add(quantum_key)
-                for downstream_key, downstream_info in prov.iter_downstream(quantum_key):
-                    downstream_data_id = downstream_info["data_id"]
-                    if (
-                        "visit" in downstream_data_id.dimensions.names
-                        and "detector" in downstream_data_id
-                        and downstream_data_id["visit"] == data_id["visit"]
-                        and downstream_data_id["detector"] == data_id["detector"]
-                    ):
-                        expected_keys_with_caveats.add(downstream_key)
-        for task_label, quanta in prov.quanta.items():
-            for quantum_key in quanta:
+                failures[quantum_key] = (data_id["visit"], data_id["detector"])
+        # Instead of walking downstream of every failure, the {visit,
+        # detector} of the failures upstream of each quantum are propagated
+        # through the graph once, in topological order, and the caveats of
+        # every quantum are checked on the way.
+        upstream_failures = {}
+        unexpected = []
+        for node in qg:
+            quantum_key = qpg.QuantumKey(node.taskDef.label, node.quantum.dataId.required_values)
+            upstream = set()
+            for input_node in qg.determineInputsToQuantumNode(node):
+                upstream.update(upstream_failures.get(input_node.nodeId, ()))
+            if quantum_key in failures:
+                upstream.add(failures[quantum_key])
+            if upstream:
+                upstream_failures[node.nodeId] = upstream
+            _, quantum_run = qpg.QuantumRun.find_final(prov.get_quantum_info(quantum_key))
+            if quantum_run.caveats:
+                data_id = node.quantum.dataId
+                visit_detector = (
+                    (data_id["visit"], data_id["detector"])
+                    if "visit" in data_id.dimensions.names and "detector" in data_id.dimensions.names
+                    else None
+                )
+                if visit_detector not in upstream:
+                    unexpected.append(quantum_key)
+        if unexpected:
+            messages = []
+            for quantum_key in sorted(unexpected, key=str):
                 quantum_info = prov.get_quantum_info(quantum_key)
-                _, quantum_run = qpg.QuantumRun.find_final(prov.get_quantum_info(quantum_key))
-                if quantum_run.caveats and quantum_key not in expected_keys_with_caveats:
-                    not_produced = [
-                        f"{dataset_key.dataset_type_name}@{dataset_info['data_id']}"
-                        for dataset_key in prov.iter_outputs_of(quantum_key)
-                        if (
-                            (dataset_info := prov.get_dataset_info(dataset_key))["status"]
-                            == qpg.DatasetInfoStatus.PREDICTED_ONLY
-                        )
-                    ]
-                    raise AssertionError(
-                        f"{quantum_key.task_label}@{quantum_info['data_id']} should not have caveats "
-                        f"{quantum_run.caveats}; missing datasets: {', '.join(not_produced)}."
+                _, quantum_run = qpg.QuantumRun.find_final(quantum_info)
+                not_produced = [
+                    f"{dataset_key.dataset_type_name}@{dataset_info['data_id']}"
+                    for dataset_key in prov.iter_outputs_of(quantum_key)
+                    if (
+                        (dataset_info := prov.get_dataset_info(dataset_key))["status"]
+                        == qpg.DatasetInfoStatus.PREDICTED_ONLY
                     )
+                ]
+                messages.append(
+                    f"{quantum_key.task_label}@{quantum_info['data_id']} should not have caveats "
+                    f"{quantum_run.caveats}; missing datasets: {', '.join(not_produced)}."
+                )
+            raise AssertionError("\n".join(messages))
 
 
 if __name__ == "__main__":